@@ -1,18 +1,46 @@
-from flask import Flask, request, jsonify, session, make_response
+from flask import Flask, Response, g, request, jsonify, session, make_response, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from datetime import datetime, timedelta
-from bson.objectid import ObjectId
 import os
 from flask import send_from_directory
 import functools
+import hashlib
+import heapq
 import re
+import threading
+import time
 from admin_credentials import ADMIN_EMAIL, ADMIN_PASSWORD, SERVICE_EMAIL, SERVICE_PASSWORD
 import traceback
+import click
 from werkzeug.utils import secure_filename
+from badge_status import (
+    backfill_status_fields, ensure_status_field_indexes, processing_days, status_fields, sweep_status_fields,
+    validity_status_days
+)
+from cache import ChangeVersions, ReplicaVersion, ResponseCache
+from compression import compress_options, compress_response
+from dates import as_date, migrate_dates, normalize_dates, parse_date
+from fields import projection, requested_fields, select, wants
+from filters import ensure_list_indexes, list_query, list_sort, list_types, unified_status
+from json_provider import OrjsonProvider
+from notifications import (
+    UNSENT, NotificationFeed, NotificationStore, PendingBadges, ensure_addition_indexes,
+    ensure_delay_indexes, parse_token
+)
+from pagination import count, fetch_merged_page, fetch_page, parse_limit, sort_spec
+from search import backfill_search_fields, ensure_search_indexes, parse_offset, search_fields, search_query
+from stats import (
+    TIMESERIES_BUCKETS, TIMESERIES_FIELDS, apply_rollup, backfill_validity_end, compute_stats,
+    compute_timeseries, ensure_rollup_indexes, ensure_status_indexes, ensure_timeseries_indexes,
+    permanent_validity_end, rebuild_rollup
+)
+from suggest import DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS, SUGGEST_FIELDS, SuggestIndex
+from trigram import TrigramIndex
 
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
 
 
@@ -34,6 +62,17 @@ temporary_badges = db.temporary_badges
 recovered_badges = db.recovered_badges
 resolved_notifications = db.resolved_notifications
 badge_additions = db.badge_additions
+notifications = db.notifications
+counters = db.counters
+notification_acks = db.notification_acks
+badge_stats = db.badge_stats
+migrations = db.migrations
+
+BADGE_COLLECTIONS = {
+    'permanent': permanent_badges,
+    'temporary': temporary_badges,
+    'recovered': recovered_badges
+}
 
 def create_default_users():
     admin_exists = users.count_documents({'username': ADMIN_EMAIL}) > 0
@@ -61,6 +100,375 @@ def create_default_users():
 create_default_users()
 
 
+def ensure_stats_rollup():
+    ensure_rollup_indexes(badge_stats)
+    if badge_stats.count_documents({'kind': 'totals'}) == 0:
+        count = rebuild_rollup(badge_stats, BADGE_COLLECTIONS)
+        print(f"Stats rollup built ({count} rows)")
+
+
+migrate_dates(BADGE_COLLECTIONS, migrations)
+backfill_validity_end(permanent_badges)
+ensure_status_indexes(permanent_badges, temporary_badges)
+ensure_timeseries_indexes(BADGE_COLLECTIONS)
+ensure_list_indexes(BADGE_COLLECTIONS)
+ensure_status_field_indexes(BADGE_COLLECTIONS)
+ensure_delay_indexes(BADGE_COLLECTIONS)
+backfill_status_fields(BADGE_COLLECTIONS)
+ensure_search_indexes(BADGE_COLLECTIONS)
+backfill_search_fields(BADGE_COLLECTIONS)
+ensure_stats_rollup()
+resolved_notifications.create_index([('badge_num', 1), ('notification_type', 1)])
+
+# New-badge events are only read for NEW_BADGE_HOURS; older ones expire
+BADGE_ADDITIONS_RETENTION_DAYS = int(os.environ.get('BADGE_ADDITIONS_RETENTION_DAYS', 7))
+ensure_addition_indexes(badge_additions, BADGE_ADDITIONS_RETENTION_DAYS)
+
+# Materialized notifications and their change sequence
+notification_store = NotificationStore(notifications, counters, notification_acks)
+notification_store.ensure_indexes()
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Regenerate the badge_stats rollup from the badge collections"""
+    count = rebuild_rollup(badge_stats, BADGE_COLLECTIONS)
+    print(f"Stats rollup rebuilt ({count} rows)")
+
+
+@app.cli.command('migrate-dates')
+@click.option('--batch-size', default=500, show_default=True, help='Documents converted per batch')
+@click.option('--restart', is_flag=True, help='Ignore saved progress and scan every document again')
+def migrate_dates_command(batch_size, restart):
+    """Convert ISO string dates in the badge collections to BSON dates"""
+    migrate_dates(BADGE_COLLECTIONS, migrations, batch_size=batch_size, restart=restart)
+    print("Date migration complete")
+
+
+@app.cli.command('sweep-statuses')
+def sweep_statuses_command():
+    """Refresh the stored statuses whose boundary has passed"""
+    changed = sweep_statuses()
+    print(f"Statuses refreshed: {changed}")
+
+
+@app.cli.command('refresh-notifications')
+def refresh_notifications_command():
+    """Regenerate the stored notifications of every badge"""
+    changes = refresh_notifications()
+    print(f"Notifications changed: {len(changes)}")
+
+
+@app.cli.command('run-workers')
+def run_workers_command():
+    """Run the status sweeps and full notification refreshes until stopped.
+
+    For deployments serving the app through a WSGI server: run exactly one.
+    """
+    start_periodic_workers()
+    print("Workers started, Ctrl+C to stop")
+    while True:
+        time.sleep(3600)
+
+
+# /api/stats is cached between writes; the date-dependent counters bound the TTL
+stats_cache = ResponseCache(ttl=int(os.environ.get('STATS_CACHE_TTL', 300)))
+
+# Write counters behind the ETags of the GET routes, shared by every process
+data_versions = ChangeVersions(counters)
+
+BADGE_DATA = ('permanent_badges', 'temporary_badges', 'recovered_badges')
+NOTIFICATION_DATA = BADGE_DATA + ('badge_additions', 'resolved_notifications', 'notifications')
+
+# Routes that write to Mongo but never change badge data
+NON_MUTATING_ENDPOINTS = {'login', 'logout', 'clear_notifications'}
+
+# Collections each write route touches; unlisted routes bump everything
+ENDPOINT_WRITES = {
+    'create_permanent_badge': ('permanent_badges', 'badge_additions'),
+    'create_temporary_badge': ('temporary_badges',),
+    'create_recovered_badge': ('recovered_badges', 'badge_additions'),
+    'update_permanent_badge': ('permanent_badges', 'badge_additions', 'resolved_notifications'),
+    'update_temporary_badge': ('temporary_badges', 'badge_additions', 'resolved_notifications'),
+    'update_recovered_badge': ('recovered_badges', 'badge_additions', 'resolved_notifications'),
+    'delete_permanent_badge': ('permanent_badges', 'badge_additions', 'resolved_notifications'),
+    'delete_temporary_badge': ('temporary_badges', 'badge_additions', 'resolved_notifications'),
+    'delete_recovered_badge': ('recovered_badges', 'badge_additions', 'resolved_notifications'),
+    'upload_contract': BADGE_DATA,
+    'delete_contract': BADGE_DATA,
+    'resolve_notification': ('notifications',),
+    'acknowledge_new_badge': ('badge_additions', 'notifications'),
+    'clear_all_notifications': ('notifications',),
+    'bulk_resolve_notifications': ('notifications',),
+}
+
+
+# Bumped by every request that changed a badge, for the in-process indexes below
+BADGE_CHANGES = 'badge_changes'
+
+# Fuzzy search and typeahead completions over every badge, kept current by
+# record_badge_change and rebuilt when another process changed badges
+search_index = TrigramIndex()
+suggest_index = SuggestIndex()
+indexed_badges = ReplicaVersion()
+
+
+def rebuild_badge_indexes():
+    def build():
+        search_index.build(BADGE_COLLECTIONS)
+        suggest_index.build(BADGE_COLLECTIONS)
+
+    indexed_badges.rebuild(lambda: data_versions.versions(BADGE_CHANGES)[BADGE_CHANGES], build)
+
+
+rebuild_badge_indexes()
+
+
+@app.after_request
+def invalidate_caches(response):
+    """Every successful write makes cached payloads and ETags stale"""
+    names = ()
+    if (request.method in ('POST', 'PUT', 'DELETE') and response.status_code < 400
+            and request.endpoint not in NON_MUTATING_ENDPOINTS):
+        names = ENDPOINT_WRITES.get(request.endpoint, NOTIFICATION_DATA)
+        stats_cache.invalidate()
+    # Even a failing request may have written a badge before it failed
+    indexed = 'index_ticket' in g
+    if indexed:
+        names += (BADGE_CHANGES,)
+    if names:
+        versions = data_versions.bump(*names)
+        if indexed:
+            indexed_badges.confirm(g.pop('index_ticket'), versions[BADGE_CHANGES])
+    return response
+
+
+def sweep_statuses():
+    changed = sweep_status_fields(BADGE_COLLECTIONS)
+    data_versions.bump(*(BADGE_COLLECTIONS[badge_type].name for badge_type, n in changed.items() if n))
+    return changed
+
+
+# Seconds between status sweeps; 0 leaves them to `flask sweep-statuses`
+STATUS_SWEEP_INTERVAL = int(os.environ.get('STATUS_SWEEP_INTERVAL', 300))
+
+
+def run_status_sweeper():
+    while True:
+        try:
+            sweep_statuses()
+        except Exception as e:
+            app.logger.error(f'Status sweep failed: {str(e)}')
+        time.sleep(STATUS_SWEEP_INTERVAL)
+
+
+# Changes to the open notifications, pushed to /api/notifications/stream
+notification_feed = NotificationFeed()
+
+# Seconds between two reads of the notification change sequence
+NOTIFICATION_POLL_INTERVAL = float(os.environ.get('NOTIFICATION_POLL_INTERVAL', 1))
+
+
+def run_notification_follower():
+    """Publish the notification changes of every process to this one's streams"""
+    token = None
+    while True:
+        try:
+            if token is None:
+                token = notification_store.token()
+            else:
+                changes, token = notification_store.log(token)
+                if changes:
+                    notification_feed.publish(changes)
+        except Exception as e:
+            app.logger.error(f'Notification follower failed: {str(e)}')
+        time.sleep(NOTIFICATION_POLL_INTERVAL)
+
+
+# Seconds between two checks for badges changed by other processes
+INDEX_POLL_INTERVAL = float(os.environ.get('INDEX_POLL_INTERVAL', 5))
+
+
+def run_index_follower():
+    """Rebuild the search and suggest indexes once another process changed badges"""
+    while True:
+        try:
+            if indexed_badges.is_behind(data_versions.versions(BADGE_CHANGES)[BADGE_CHANGES]):
+                rebuild_badge_indexes()
+        except Exception as e:
+            app.logger.error(f'Search index rebuild failed: {str(e)}')
+        time.sleep(INDEX_POLL_INTERVAL)
+
+
+# Days a lapsed notification is kept as a tombstone for ?since= clients
+NOTIFICATION_TOMBSTONE_DAYS = int(os.environ.get('NOTIFICATION_TOMBSTONE_DAYS', 7))
+
+
+# One refresh at a time in the process, so a full one never writes over a newer targeted one
+refresh_lock = threading.Lock()
+
+
+def refresh_notifications(badge_nums=None):
+    with refresh_lock:
+        changes = notification_store.sync(
+            BADGE_COLLECTIONS, badge_additions, resolved_notifications, badge_nums=badge_nums
+        )
+        purged = 0
+        if badge_nums is None:
+            purged = notification_store.purge(datetime.now() - timedelta(days=NOTIFICATION_TOMBSTONE_DAYS))
+    if changes or purged:
+        data_versions.bump('notifications')
+    return changes
+
+
+def acknowledge_notifications(query):
+    """Acknowledge the open notifications matching ``query`` for the current user"""
+    return notification_store.acknowledge(session['user']['username'], query)
+
+
+# Badges written by requests, regenerated by the notification generator
+pending_notifications = PendingBadges()
+
+# Seconds between full notification refreshes, which move the 6/10-day and
+# 30-day thresholds; 0 leaves them to `flask refresh-notifications`
+NOTIFICATION_REFRESH_INTERVAL = int(os.environ.get('NOTIFICATION_REFRESH_INTERVAL', 300))
+
+
+def run_notification_generator():
+    while True:
+        badge_nums = pending_notifications.wait()
+        try:
+            if badge_nums:
+                refresh_notifications(badge_nums)
+        except Exception as e:
+            app.logger.error(f'Notification refresh failed: {str(e)}')
+
+
+def run_notification_refresher():
+    while True:
+        try:
+            refresh_notifications()
+        except Exception as e:
+            app.logger.error(f'Notification refresh failed: {str(e)}')
+        time.sleep(NOTIFICATION_REFRESH_INTERVAL)
+
+
+def start_periodic_workers():
+    """Status sweeps and full notification refreshes. One process is enough
+    to run them: the development server's, or `flask run-workers`."""
+    if STATUS_SWEEP_INTERVAL > 0:
+        threading.Thread(target=run_status_sweeper, name='status-sweeper', daemon=True).start()
+    if NOTIFICATION_REFRESH_INTERVAL > 0:
+        threading.Thread(target=run_notification_refresher, name='notification-refresher', daemon=True).start()
+
+
+# Started by the first request a process serves: the reloader's parent
+# process and CLI commands import this module too, but never serve
+process_workers_started = threading.Event()
+process_workers_lock = threading.Lock()
+
+
+@app.before_request
+def start_process_workers():
+    """Threads every serving process needs: the generator for the badges its
+    requests write, the follower feeding its notification streams and the one
+    keeping its search indexes current"""
+    if process_workers_started.is_set():
+        return
+    with process_workers_lock:
+        if process_workers_started.is_set():
+            return
+        threading.Thread(target=run_notification_generator, name='notification-generator', daemon=True).start()
+        threading.Thread(target=run_notification_follower, name='notification-follower', daemon=True).start()
+        threading.Thread(target=run_index_follower, name='index-follower', daemon=True).start()
+        process_workers_started.set()
+
+
+@app.after_request
+def queue_notification_refresh(response):
+    """Hand the badges this request wrote to the notification generator"""
+    badge_nums = g.pop('changed_badges', None)
+    if badge_nums:
+        pending_notifications.add(badge_nums)
+    return response
+
+
+# Responses smaller than this are sent as they are
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request, app.view_functions.get(request.endpoint), COMPRESS_MIN_SIZE)
+
+
+def conditional_get(*collections, period='hour'):
+    """Answer If-None-Match with 304 when none of ``collections`` changed.
+
+    The ETag is derived from the shared write counters, the user, the request
+    URL and the current hour (or day), since statuses and day counts move with
+    the clock: a day count computed from a request timestamp ticks over at that
+    time of day, not at midnight. A matching tag is answered with a single
+    read of the counters. ``period`` may also be a number of seconds, for
+    payloads that are recomputed that often.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            now = datetime.now()
+            if period == 'hour':
+                clock = now.strftime('%Y-%m-%dT%H')
+            elif period == 'day':
+                clock = now.strftime('%Y-%m-%d')
+            else:
+                clock = str(int(now.timestamp() // period))
+            key = '|'.join([
+                data_versions.stamp(*collections),
+                clock,
+                session['user'].get('role', ''),
+                session['user'].get('username', ''),
+                request.full_path
+            ])
+            etag = hashlib.sha1(key.encode()).hexdigest()
+
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(func(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                # Let browsers keep the body but revalidate it on every use
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def record_badge_change(badge_type, before=None, after=None):
+    """Propagate a badge create/update/delete to derived data"""
+    try:
+        apply_rollup(badge_stats, badge_type, before=before, after=after)
+    except Exception as e:
+        app.logger.error(f'Stats rollup update failed, run `flask rebuild-stats`: {str(e)}')
+    # Taken before the indexes change, see ReplicaVersion
+    if 'index_ticket' not in g:
+        g.index_ticket = indexed_badges.begin()
+    try:
+        search_index.update(badge_type, before=before, after=after)
+    except Exception as e:
+        app.logger.error(f'Search index update failed: {str(e)}')
+    try:
+        suggest_index.update(before=before, after=after)
+    except Exception as e:
+        app.logger.error(f'Suggest index update failed: {str(e)}')
+    # Queued once the request is done, so its other writes (badge_additions, ...) are visible
+    g.setdefault('changed_badges', set()).update(
+        badge['badge_num'] for badge in (before, after) if badge is not None and badge.get('badge_num')
+    )
+
+
 def sanitize_filename(filename):
     """Sanitize filename to remove special characters"""
     # Replace spaces with underscores and remove special characters
@@ -98,40 +506,6 @@ def get_upload_path(badge_type, badge_data):
     
     return folder, filename
 
-def update_badge_status(badge):
-    today = datetime.now()
-
-    # تحويل التواريخ إذا كانت string
-    verification_date = badge.get("verification_date")
-    validity_end = badge.get("validity_end")
-
-    # تحويل التواريخ إلى datetime إذا كانوا string
-    if isinstance(verification_date, str):
-        verification_date = datetime.fromisoformat(verification_date)
-
-    if isinstance(validity_end, str):
-        validity_end = datetime.fromisoformat(validity_end)
-
-    # تحديد الحالة إذا كان البادج قد تم التحقق منه أو لا
-    if verification_date:
-        days_since_verification = (today - verification_date).days
-        if days_since_verification > 10:
-            return "Expired"  # الحالة إذا مر 10 أيام من تاريخ التحقق
-
-    # إذا كانت الـ badge في مرحلة التحقق ولم تنتهِ المدة
-    if validity_end and today < validity_end:
-        return "Processing"  # إذا كانت المدة لم تنتهي بعد
-
-    # إذا كانت الـ badge قد تمت الموافقة عليها خلال فترة صلاحيتها
-    if verification_date and today <= validity_end:
-        return "Active"  # البادج صالحة
-
-    # إذا انتهت المدة ولم يتم التحقق
-    if validity_end and today > validity_end:
-        return "Expired"  # البادج منتهية الصلاحية
-    
-    return "Unknown"  # في حالة ما إذا كانت هناك مشكلة أو لا توجد معلومات كافية
-
 def require_auth(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
@@ -244,420 +618,235 @@ def is_notification_resolved(badge_num, notification_type):
 
 @app.route('/api/stats', methods=['GET'])
 @require_auth
+# The cached counters move with the clock: a new ETag at least once per TTL
+@conditional_get(*BADGE_DATA, period=stats_cache.ttl)
 def get_stats():
     try:
-        def safe_aggregate_by_date(collection, date_field, format_string):
-            """Safely aggregate data by date with better error handling"""
-            try:
-                documents = list(collection.find({date_field: {"$exists": True, "$ne": None}}))
-                date_counts = {}
-                
-                for doc in documents:
-                    date_value = doc.get(date_field)
-                    if not date_value:
-                        continue
-                    
-                    if isinstance(date_value, str):
-                        try:
-                            if 'T' in date_value:
-                                date_value = datetime.fromisoformat(date_value.replace('Z', '+00:00'))
-                            else:
-                                date_value = datetime.strptime(date_value, '%Y-%m-%d')
-                        except:
-                            continue
-                    
-                    if isinstance(date_value, datetime):
-                        if format_string == "%Y-%m":
-                            key = date_value.strftime("%Y-%m")
-                        elif format_string == "%Y":
-                            key = date_value.strftime("%Y")
-                        else:
-                            key = date_value.strftime(format_string)
-                        
-                        date_counts[key] = date_counts.get(key, 0) + 1
-                
-                result = [{"_id": key, "count": count} for key, count in sorted(date_counts.items())]
-                return result
-                
-            except Exception as e:
-                app.logger.warning(f'Safe aggregation failed for {date_field}: {str(e)}')
-                return []
-
-        # Get aggregated stats
-        permanent_by_month = safe_aggregate_by_date(permanent_badges, "request_date", "%Y-%m")
-        temporary_by_month = safe_aggregate_by_date(temporary_badges, "request_date", "%Y-%m")
-        recovered_by_month = safe_aggregate_by_date(recovered_badges, "recovery_date", "%Y-%m")
-
-        permanent_by_year = safe_aggregate_by_date(permanent_badges, "request_date", "%Y")
-        temporary_by_year = safe_aggregate_by_date(temporary_badges, "request_date", "%Y")
-        recovered_by_year = safe_aggregate_by_date(recovered_badges, "recovery_date", "%Y")
-
-        # Calculate summary stats
-        total_permanent = permanent_badges.count_documents({})
-        total_temporary = temporary_badges.count_documents({})
-        total_recovered = recovered_badges.count_documents({})
-        total_all = total_permanent + total_temporary + total_recovered
-        
-        # Calculate real status counts from ALL badges - FIXED: Don't count recovered badges as valid
         today = datetime.now()
-        
-        # Count valid badges (active and not expired) - ONLY permanent and temporary
-        valid_count = 0
-        expired_count = 0
-        processing_count = 0
-        delayed_count = 0
-        
-        # Check permanent badges
-        for badge in permanent_badges.find({}):
-            gr_return_date = badge.get('gr_return_date')
-            request_date = badge.get('request_date')
-            
-            # Convert dates
-            if isinstance(gr_return_date, str):
-                try:
-                    gr_return_date = datetime.fromisoformat(gr_return_date.replace('Z', '+00:00'))
-                except:
-                    gr_return_date = None
-            
-            if isinstance(request_date, str):
-                try:
-                    request_date = datetime.fromisoformat(request_date.replace('Z', '+00:00'))
-                except:
-                    request_date = None
-            
-            if gr_return_date:
-                # Badge completed - check if still valid
-                validity_duration = badge.get('validity_duration', '1 year')
-                if validity_duration == '1 year':
-                    validity_end = gr_return_date + timedelta(days=365)
-                elif validity_duration == '3 years':
-                    validity_end = gr_return_date + timedelta(days=365*3)
-                elif validity_duration == '5 years':
-                    validity_end = gr_return_date + timedelta(days=365*5)
-                else:
-                    validity_end = gr_return_date + timedelta(days=365)
-                
-                if today <= validity_end:
-                    valid_count += 1
-                else:
-                    expired_count += 1
-            else:
-                # Badge in processing
-                if request_date:
-                    days_since_request = (today - request_date).days
-                    if days_since_request >= 6:
-                        delayed_count += 1
-                    processing_count += 1
-                else:
-                    processing_count += 1
-
-        # Check temporary badges
-        for badge in temporary_badges.find({}):
-            validity_end = badge.get('validity_end')
-            request_date = badge.get('request_date')
-            gr_return_date = badge.get('gr_return_date')
-            
-            # Convert dates
-            if isinstance(validity_end, str):
-                try:
-                    validity_end = datetime.fromisoformat(validity_end.replace('Z', '+00:00'))
-                except:
-                    validity_end = None
-            
-            if isinstance(request_date, str):
-                try:
-                    request_date = datetime.fromisoformat(request_date.replace('Z', '+00:00'))
-                except:
-                    request_date = None
-            
-            if isinstance(gr_return_date, str):
-                try:
-                    gr_return_date = datetime.fromisoformat(gr_return_date.replace('Z', '+00:00'))
-                except:
-                    gr_return_date = None
-            
-            if gr_return_date and validity_end:
-                # Badge completed - check validity
-                if today <= validity_end:
-                    valid_count += 1
-                else:
-                    expired_count += 1
-            else:
-                # Badge in processing
-                if request_date:
-                    days_since_request = (today - request_date).days
-                    if days_since_request >= 6:
-                        delayed_count += 1
-                    processing_count += 1
-                else:
-                    processing_count += 1
-
-        # RECOVERED BADGES ARE NOT COUNTED AS VALID - THEY HAVE THEIR OWN CATEGORY
-        # They are only included in total_recovered count
-        
-        # Count unique companies from all collections
-        perm_companies = set(permanent_badges.distinct("company"))
-        temp_companies = set(temporary_badges.distinct("company"))
-        rec_companies = set(recovered_badges.distinct("company"))
-        total_companies = len(perm_companies.union(temp_companies).union(rec_companies))
-
-        # Calculate processing time from completed badges
-        def calculate_processing_times():
-            processing_times = []
-            
-            # Check permanent badges
-            for badge in permanent_badges.find({"gr_return_date": {"$exists": True, "$ne": None, "$ne": ""}}):
-                request_date = badge.get("request_date")
-                gr_return_date = badge.get("gr_return_date")
-                
-                if request_date and gr_return_date:
-                    try:
-                        if isinstance(request_date, str):
-                            request_date = datetime.fromisoformat(request_date.replace('Z', '+00:00'))
-                        if isinstance(gr_return_date, str):
-                            gr_return_date = datetime.fromisoformat(gr_return_date.replace('Z', '+00:00'))
-                        
-                        if isinstance(request_date, datetime) and isinstance(gr_return_date, datetime):
-                            days_diff = (gr_return_date - request_date).days
-                            if 0 <= days_diff <= 365:
-                                processing_times.append(days_diff)
-                    except:
-                        continue
-            
-            # Check temporary badges
-            for badge in temporary_badges.find({"gr_return_date": {"$exists": True, "$ne": None, "$ne": ""}}):
-                request_date = badge.get("request_date")
-                gr_return_date = badge.get("gr_return_date")
-                
-                if request_date and gr_return_date:
-                    try:
-                        if isinstance(request_date, str):
-                            request_date = datetime.fromisoformat(request_date.replace('Z', '+00:00'))
-                        if isinstance(gr_return_date, str):
-                            gr_return_date = datetime.fromisoformat(gr_return_date.replace('Z', '+00:00'))
-                        
-                        if isinstance(request_date, datetime) and isinstance(gr_return_date, datetime):
-                            days_diff = (gr_return_date - request_date).days
-                            if 0 <= days_diff <= 365:
-                                processing_times.append(days_diff)
-                    except:
-                        continue
-            
-            return processing_times
-
-        processing_times = calculate_processing_times()
-        avg_processing_time = round(sum(processing_times) / len(processing_times), 1) if processing_times else 7.2
-
-        # Calculate real expiring badges (next 30 days) - only permanent and temporary
-        expiry_cutoff = today + timedelta(days=30)
-        expiring_soon = 0
-        
-        # Check permanent badges expiring soon
-        for badge in permanent_badges.find({"gr_return_date": {"$exists": True, "$ne": None}}):
-            gr_return_date = badge.get('gr_return_date')
-            if isinstance(gr_return_date, str):
-                try:
-                    gr_return_date = datetime.fromisoformat(gr_return_date.replace('Z', '+00:00'))
-                except:
-                    continue
-            
-            if isinstance(gr_return_date, datetime):
-                validity_duration = badge.get('validity_duration', '1 year')
-                if validity_duration == '1 year':
-                    validity_end = gr_return_date + timedelta(days=365)
-                elif validity_duration == '3 years':
-                    validity_end = gr_return_date + timedelta(days=365*3)
-                elif validity_duration == '5 years':
-                    validity_end = gr_return_date + timedelta(days=365*5)
-                else:
-                    validity_end = gr_return_date + timedelta(days=365)
-                
-                if today < validity_end <= expiry_cutoff:
-                    expiring_soon += 1
-        
-        # Check temporary badges expiring soon
-        for badge in temporary_badges.find({}):
-            validity_end = badge.get('validity_end')
-            if isinstance(validity_end, str):
-                try:
-                    validity_end = datetime.fromisoformat(validity_end.replace('Z', '+00:00'))
-                except:
-                    continue
-            
-            if isinstance(validity_end, datetime) and today < validity_end <= expiry_cutoff:
-                expiring_soon += 1
-
-        # Calculate data quality metrics
-        total_records = total_all
-        complete_records = 0
-        accurate_dates = 0
-        matched_companies = 0
-        updated_statuses = 0
-
-        # Check data completeness
-        for collection in [permanent_badges, temporary_badges, recovered_badges]:
-            for badge in collection.find({}):
-                required_fields = ['badge_num', 'full_name', 'company', 'cin']
-                if all(badge.get(field) for field in required_fields):
-                    complete_records += 1
-                
-                # Check date accuracy
-                date_fields = ['request_date', 'recovery_date']
-                for field in date_fields:
-                    if badge.get(field):
-                        accurate_dates += 1
-                        break
-                
-                # Check company matching (assume 92% have proper company data)
-                if badge.get('company') and len(badge.get('company', '')) > 2:
-                    matched_companies += 1
-                
-                # Check status updates (assume 88% have recent updates)
-                if badge.get('gr_return_date') or badge.get('dgsn_sent'):
-                    updated_statuses += 1
-
-        # Calculate percentages
-        complete_percentage = round((complete_records / total_records * 100), 1) if total_records > 0 else 100
-        date_accuracy = round((accurate_dates / total_records * 100), 1) if total_records > 0 else 100
-        company_matching = round((matched_companies / total_records * 100), 1) if total_records > 0 else 100
-        status_updates = round((updated_statuses / total_records * 100), 1) if total_records > 0 else 100
+        # Keyed on the shared versions: writes through other processes count too
+        stats, summary = stats_cache.get_or_compute(
+            ('stats', today.date(), data_versions.stamp(*BADGE_DATA)),
+            lambda: compute_stats(badge_stats, permanent_badges, temporary_badges, today)
+        )
 
         response = {
             'success': True,
-            'stats': {
-                'permanent_by_month': permanent_by_month,
-                'temporary_by_month': temporary_by_month,
-                'recovered_by_month': recovered_by_month,
-                'permanent_by_year': permanent_by_year,
-                'temporary_by_year': temporary_by_year,
-                'recovered_by_year': recovered_by_year
-            },
-            'summary': {
-                'total_all': total_all,
-                'total_permanent': total_permanent,
-                'total_temporary': total_temporary,
-                'total_recovered': total_recovered,
-                'valid_badges': valid_count,  # Now only permanent + temporary valid badges
-                'expired_badges': expired_count,
-                'processing_badges': processing_count,
-                'delayed_badges': delayed_count,
-                'expiring_soon': expiring_soon,
-                'companies': total_companies,
-                'avg_processing_time': avg_processing_time,
-                'data_quality': {
-                    'complete_records': complete_percentage,
-                    'date_accuracy': date_accuracy,
-                    'company_matching': company_matching,
-                    'status_updates': status_updates
-                }
-            }
+            'stats': stats,
+            'summary': summary
         }
 
-        app.logger.info(f'Real stats calculated: Total={total_all}, Valid={valid_count}, Expired={expired_count}, Processing={processing_count}, Delayed={delayed_count}')
+        app.logger.info(f"Real stats calculated: Total={summary['total_all']}, Valid={summary['valid_badges']}, Expired={summary['expired_badges']}, Processing={summary['processing_badges']}, Delayed={summary['delayed_badges']}")
         return jsonify(response)
 
     except Exception as e:
         app.logger.error(f'Stats error: {str(e)}')
         return jsonify({'success': False, 'message': f'Failed to fetch stats: {str(e)}'}), 500
+
+@app.route('/api/stats/cache', methods=['GET'])
+@require_auth
+def get_stats_cache_metrics():
+    if session['user'].get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    return jsonify({'success': True, 'cache': stats_cache.metrics()})
+
+
+@app.route('/api/stats/timeseries', methods=['GET'])
+@require_auth
+@conditional_get(*BADGE_DATA)
+def get_stats_timeseries():
+    try:
+        badge_type = request.args.get('type', 'permanent')
+        if badge_type not in TIMESERIES_FIELDS:
+            return jsonify({'success': False, 'message': 'Invalid badge type'}), 400
+
+        field = request.args.get('field', TIMESERIES_FIELDS[badge_type][0])
+        if field not in TIMESERIES_FIELDS[badge_type]:
+            return jsonify({'success': False, 'message': f"Field must be one of {', '.join(TIMESERIES_FIELDS[badge_type])}"}), 400
+
+        bucket = request.args.get('bucket', 'month')
+        if bucket not in TIMESERIES_BUCKETS:
+            return jsonify({'success': False, 'message': f"Bucket must be one of {', '.join(TIMESERIES_BUCKETS)}"}), 400
+
+        end = parse_date(request.args['to']) if request.args.get('to') else datetime.now()
+        start = parse_date(request.args['from']) if request.args.get('from') else end - timedelta(days=365)
+        if not start or not end or start >= end:
+            return jsonify({'success': False, 'message': 'Invalid date range'}), 400
+
+        try:
+            series = compute_timeseries(BADGE_COLLECTIONS[badge_type], field, start, end, bucket)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        return jsonify({
+            'success': True,
+            'type': badge_type,
+            'field': field,
+            'bucket': bucket,
+            'from': start,
+            'to': end,
+            'series': series
+        })
+
+    except Exception as e:
+        app.logger.error(f'Stats timeseries error: {str(e)}')
+        return jsonify({'success': False, 'message': 'Failed to fetch time series'}), 500
+
+def all_badges_entry(badge_type, badge, fields=None, today=None):
+    """Shape a stored badge for the unified /api/badges listing"""
+    status, delay = unified_status(badge_type, badge, today or datetime.now())
+    badge.pop('_id', None)
+    badge = fix_encoding_comprehensive(badge)
+    badge['badgeType'] = badge_type
+    badge['badgeNumber'] = badge.get('badge_num')
+    badge['fullName'] = badge.get('full_name')
+
+    if badge_type == 'permanent':
+        badge['requestDate'] = badge.get('request_date')
+        badge['validityDuration'] = badge.get('validity_duration', 'Permanent')
+
+    elif badge_type == 'temporary':
+        # Calculate validity duration
+        validity_start = as_date(badge.get('validity_start'))
+        validity_end = as_date(badge.get('validity_end'))
+        if validity_start and validity_end:
+            duration = (validity_end - validity_start).days
+            badge['validityDuration'] = f"{duration} days"
+        else:
+            badge['validityDuration'] = 'Unknown'
+
+        badge['requestDate'] = badge.get('request_date')
+
+    else:
+        badge['requestDate'] = badge.get('recovery_date')
+
+        # Fix recovery type display - this ensures ALL are counted
+        recovery_type = badge.get('recovery_type', 'Unknown')
+
+        if recovery_type == 'décharge':
+            badge['validityDuration'] = 'décharge'
+            badge['recovery_display'] = 'décharge'
+        elif recovery_type == 'renouvellement':
+            sub_type = badge.get('badge_type', '')
+            if sub_type:
+                badge['validityDuration'] = f'renouvellement ({sub_type})'
+                badge['recovery_display'] = f'renouvellement ({sub_type})'
+            else:
+                badge['validityDuration'] = 'renouvellement'
+                badge['recovery_display'] = 'renouvellement'
+        else:
+            badge['validityDuration'] = recovery_type
+            badge['recovery_display'] = recovery_type
+
+        badge['badge_type'] = badge.get('badge_type')
+        badge['recovery_type'] = recovery_type
+
+    # Same rules as ?status=, so every listed badge carries the status it was filtered on
+    badge['status'] = status
+    badge['processingDelay'] = delay
+    return select(badge, fields)
+
+
+def wants_page():
+    return 'limit' in request.args or 'after' in request.args
+
+
+# Documents per round trip when streaming a listing
+STREAM_BATCH_SIZE = 500
+
+
+def stream_badges(sources, direction, fields=None, today=None):
+    """NDJSON export of the unified listing, one badge per line.
+
+    Documents go from the Mongo cursors to the socket one batch at a time,
+    so memory stays flat and the first line leaves before the last is read.
+    """
+    def generate():
+        for badge_type, collection, query, sort_field in sources:
+            docs = (
+                collection.find(query, projection(fields, 'all', sort_field))
+                .sort(sort_spec(sort_field, direction))
+                .batch_size(STREAM_BATCH_SIZE)
+            )
+            for badge in docs:
+                yield app.json.dumps(all_badges_entry(badge_type, badge, fields, today)) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def page_response(badges, total, next_cursor, limit):
+    return jsonify({
+        'success': True,
+        'badges': badges,
+        'total': total,
+        'limit': limit,
+        'next_cursor': next_cursor
+    })
+
+
+def list_badges(badge_type, entries):
+    """Serve one badge collection, filtered and sorted from the query string
+    and paged by ?limit=&after= when asked to"""
+    collection = BADGE_COLLECTIONS[badge_type]
+    try:
+        query = list_query(badge_type, request.args, datetime.now())
+        sort_field, direction = list_sort(badge_type, request.args)
+        fields = requested_fields(request.args)
+        fields_projection = projection(fields, badge_type, sort_field)
+        if not wants_page():
+            docs = list(collection.find(query, fields_projection).sort(sort_spec(sort_field, direction)))
+            return jsonify({'success': True, 'badges': entries(docs, fields)})
+
+        limit = parse_limit(request.args.get('limit'))
+        docs, next_cursor = fetch_page(
+            collection, query, fields_projection, limit, request.args.get('after'), sort_field, direction
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return page_response(entries(docs, fields), count(collection, query), next_cursor, limit)
+
+
 # Also add this route to get all badges for the dashboard
 @app.route('/api/badges', methods=['GET'])
 @require_auth
+@conditional_get(*BADGE_DATA)
 def get_all_badges():
     try:
-        all_badges = []
-        
-        # Get permanent badges
-        for badge in permanent_badges.find({}, {'_id': 0}):
-            badge = fix_encoding_comprehensive(badge)
-            badge['badgeType'] = 'permanent'
-            badge['badgeNumber'] = badge.get('badge_num')
-            badge['fullName'] = badge.get('full_name')
-            badge['requestDate'] = badge.get('request_date')
-            badge['validityDuration'] = badge.get('validity_duration', 'Permanent')
-            badge['status'] = 'active'
-            all_badges.append(badge)
-        
-        # Get temporary badges
-        for badge in temporary_badges.find({}, {'_id': 0}):
-            badge = fix_encoding_comprehensive(badge)
-            badge['badgeType'] = 'temporary'
-            badge['badgeNumber'] = badge.get('badge_num')
-            badge['fullName'] = badge.get('full_name')
-            badge['requestDate'] = badge.get('request_date')
-            
-            # Calculate validity duration
-            validity_start = badge.get('validity_start')
-            validity_end = badge.get('validity_end')
-            if validity_start and validity_end:
-                try:
-                    if isinstance(validity_start, str):
-                        validity_start = datetime.fromisoformat(validity_start.replace('Z', '+00:00'))
-                    if isinstance(validity_end, str):
-                        validity_end = datetime.fromisoformat(validity_end.replace('Z', '+00:00'))
-                    
-                    if isinstance(validity_start, datetime) and isinstance(validity_end, datetime):
-                        duration = (validity_end - validity_start).days
-                        badge['validityDuration'] = f"{duration} days"
-                    else:
-                        badge['validityDuration'] = 'Unknown'
-                except:
-                    badge['validityDuration'] = 'Unknown'
-            else:
-                badge['validityDuration'] = 'Unknown'
-            
-            # Determine status
-            today = datetime.now()
-            if validity_end:
-                if isinstance(validity_end, str):
-                    try:
-                        validity_end = datetime.fromisoformat(validity_end.replace('Z', '+00:00'))
-                    except:
-                        validity_end = None
-                
-                if isinstance(validity_end, datetime):
-                    if validity_end > today:
-                        badge['status'] = 'active'
-                    else:
-                        badge['status'] = 'expired'
-                else:
-                    badge['status'] = 'unknown'
-            else:
-                badge['status'] = 'unknown'
-                
-            all_badges.append(badge)
-        
-        # Get recovered badges - COMPLETELY FIXED
-        for badge in recovered_badges.find({}, {'_id': 0}):
-            badge = fix_encoding_comprehensive(badge)
-            badge['badgeType'] = 'recovered'
-            badge['badgeNumber'] = badge.get('badge_num')
-            badge['fullName'] = badge.get('full_name')
-            badge['requestDate'] = badge.get('recovery_date')
-            
-            # Fix recovery type display - this ensures ALL are counted
-            recovery_type = badge.get('recovery_type', 'Unknown')
-            
-            if recovery_type == 'décharge':
-                badge['validityDuration'] = 'décharge'
-                badge['recovery_display'] = 'décharge'
-            elif recovery_type == 'renouvellement':
-                sub_type = badge.get('badge_type', '')
-                if sub_type:
-                    badge['validityDuration'] = f'renouvellement ({sub_type})'
-                    badge['recovery_display'] = f'renouvellement ({sub_type})'
-                else:
-                    badge['validityDuration'] = 'renouvellement'
-                    badge['recovery_display'] = 'renouvellement'
-            else:
-                badge['validityDuration'] = recovery_type
-                badge['recovery_display'] = recovery_type
-            
-            badge['status'] = 'recovered'
-            badge['badge_type'] = badge.get('badge_type')
-            badge['recovery_type'] = recovery_type
-            all_badges.append(badge)
-        
-        return jsonify({'success': True, 'badges': all_badges})
+        today = datetime.now()
+        try:
+            sources = []
+            for badge_type in list_types(request.args):
+                sort_field, direction = list_sort(badge_type, request.args)
+                sources.append((
+                    badge_type,
+                    BADGE_COLLECTIONS[badge_type],
+                    list_query(badge_type, request.args, today),
+                    sort_field
+                ))
+
+            fields = requested_fields(request.args)
+
+            if request.args.get('format') == 'ndjson':
+                return stream_badges(sources, direction, fields, today)
+
+            if not wants_page():
+                all_badges = []
+                for badge_type, collection, query, sort_field in sources:
+                    docs = collection.find(query, projection(fields, 'all', sort_field))
+                    for badge in docs.sort(sort_spec(sort_field, direction)):
+                        all_badges.append(all_badges_entry(badge_type, badge, fields, today))
+                return jsonify({'success': True, 'badges': all_badges})
+
+            limit = parse_limit(request.args.get('limit'))
+            sort_fields = {sort_field for _, _, _, sort_field in sources}
+            page, next_cursor = fetch_merged_page(
+                sources, projection(fields, 'all', *sort_fields), limit, request.args.get('after'), direction
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        total = sum(count(collection, query) for _, collection, query, _ in sources)
+        badges = [all_badges_entry(badge_type, badge, fields, today) for badge_type, badge in page]
+        return page_response(badges, total, next_cursor, limit)
         
     except Exception as e:
         app.logger.error(f'Get all badges error: {str(e)}')
@@ -665,231 +854,234 @@ def get_all_badges():
 
 @app.route('/api/search', methods=['GET'])
 @require_auth
+@conditional_get(*BADGE_DATA)
 def search_badges():
     try:
-        query = request.args.get('query', '').lower()
-        if not query:
-            return jsonify({'success': False, 'message': 'Query required'}), 400
+        try:
+            query = search_query(request.args.get('query', ''))
+            fields = requested_fields(request.args)
+            limit = parse_limit(request.args.get('limit'))
+            offset = parse_offset(request.args.get('offset'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        # Each collection contributes at most offset + limit + 1 matches,
+        # merged in badge number order
+        streams = []
+        for badge_type, collection in BADGE_COLLECTIONS.items():
+            docs = (
+                collection.find(query, {**projection(fields, badge_type, 'badge_num'), '_id': 0})
+                .sort('badge_num', 1)
+                .limit(offset + limit + 1)
+            )
+            streams.append([(badge_type, badge) for badge in docs])
+        matches = list(heapq.merge(*streams, key=lambda item: str(item[1].get('badge_num', ''))))
 
         results = []
-
-        # Search permanent badges
-        for badge in permanent_badges.find({
-            '$or': [
-                {'badge_num': {'$regex': query, '$options': 'i'}},
-                {'full_name': {'$regex': query, '$options': 'i'}},
-                {'company': {'$regex': query, '$options': 'i'}},
-                {'cin': {'$regex': query, '$options': 'i'}}
-            ]
-        }, {'_id': 0}):
-            badge['type'] = 'permanent'
+        for badge_type, badge in matches[offset:offset + limit]:
+            badge = select(badge, fields)
+            badge['type'] = badge_type
             results.append(badge)
 
-        # Search temporary badges
-        for badge in temporary_badges.find({
-            '$or': [
-                {'badge_num': {'$regex': query, '$options': 'i'}},
-                {'full_name': {'$regex': query, '$options': 'i'}},
-                {'company': {'$regex': query, '$options': 'i'}},
-                {'cin': {'$regex': query, '$options': 'i'}}
-            ]
-        }, {'_id': 0}):
-            badge['type'] = 'temporary'
-            results.append(badge)
+        return jsonify({
+            'success': True,
+            'results': results,
+            'limit': limit,
+            'offset': offset,
+            'has_more': len(matches) > offset + limit
+        })
+    except Exception as e:
+        app.logger.error(f'Search error: {str(e)}')
+        return jsonify({'success': False, 'message': 'Failed to search badges'}), 500
+
+
+@app.route('/api/search/fuzzy', methods=['GET'])
+@require_auth
+@conditional_get(*BADGE_DATA)
+def fuzzy_search_badges():
+    try:
+        try:
+            term = request.args.get('query', '')
+            if not term.strip():
+                raise ValueError('Query required')
+            fields = requested_fields(request.args)
+            limit = parse_limit(request.args.get('limit'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        ranked = search_index.search(term, limit)
+
+        # One round trip per badge type for the matched documents
+        badge_nums = {}
+        for badge_type, badge_num, _ in ranked:
+            badge_nums.setdefault(badge_type, []).append(badge_num)
+        found = {}
+        for badge_type, nums in badge_nums.items():
+            docs = BADGE_COLLECTIONS[badge_type].find(
+                {'badge_num': {'$in': nums}}, {**projection(fields, badge_type, 'badge_num'), '_id': 0}
+            )
+            for badge in docs:
+                found[(badge_type, badge.get('badge_num'))] = badge
 
-        # Search recovered badges
-        for badge in recovered_badges.find({
-            '$or': [
-                {'badge_num': {'$regex': query, '$options': 'i'}},
-                {'full_name': {'$regex': query, '$options': 'i'}},
-                {'company': {'$regex': query, '$options': 'i'}},
-                {'cin': {'$regex': query, '$options': 'i'}}
-            ]
-        }, {'_id': 0}):
-            badge['type'] = 'recovered'
+        results = []
+        for badge_type, badge_num, score in ranked:
+            badge = found.get((badge_type, badge_num))
+            if badge is None:
+                continue
+            badge = select(badge, fields)
+            badge['type'] = badge_type
+            badge['score'] = score
             results.append(badge)
 
         return jsonify({'success': True, 'results': results})
     except Exception as e:
-        app.logger.error(f'Search error: {str(e)}')
+        app.logger.error(f'Fuzzy search error: {str(e)}')
         return jsonify({'success': False, 'message': 'Failed to search badges'}), 500
 
 
-# Replace the existing notifications routes in app.py with this:
-
-@app.route('/api/notifications', methods=['GET'])
+@app.route('/api/suggest', methods=['GET'])
 @require_auth
-def get_notifications():
+@conditional_get(*BADGE_DATA)
+def suggest():
+    field = request.args.get('field', 'company')
+    if field not in SUGGEST_FIELDS:
+        return jsonify({'success': False, 'message': f"field must be one of {', '.join(SUGGEST_FIELDS)}"}), 400
     try:
-        if session['user'].get('role') != 'admin':
-            return jsonify({'success': False, 'message': 'Accès administrateur requis'}), 403
+        limit = int(request.args.get('limit') or DEFAULT_SUGGESTIONS)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit must be an integer'}), 400
+    if not 1 <= limit <= MAX_SUGGESTIONS:
+        return jsonify({'success': False, 'message': f'limit must be between 1 and {MAX_SUGGESTIONS}'}), 400
+
+    prefix = request.args.get('prefix', '')
+    response = {
+        'success': True,
+        'field': field,
+        'suggestions': suggest_index.suggest(field, prefix, limit)
+    }
+    if field == 'badge_num':
+        # Lets the forms flag a duplicate badge number before submitting
+        response['exists'] = suggest_index.exists('badge_num', prefix)
+    return jsonify(response)
 
-        notifications = []
-        today = datetime.now()
 
-        def calculate_days_delayed(request_date):
-            if isinstance(request_date, str):
-                try:
-                    request_date = datetime.fromisoformat(request_date.replace('Z', '+00:00'))
-                except:
-                    return 0
-            if isinstance(request_date, datetime):
-                return (today - request_date).days
-            return 0
-
-        def safe_datetime_convert(date_value):
-            if isinstance(date_value, str):
-                try:
-                    return datetime.fromisoformat(date_value.replace('Z', '+00:00'))
-                except:
-                    return None
-            elif isinstance(date_value, datetime):
-                return date_value
-            return None
-
-        # Vérifier les badges permanents en retard (6+ jours)
-        for badge in permanent_badges.find({"dgsn_sent": {"$exists": False}}, {'_id': 0}):
-            request_date = badge.get('request_date')
-            days_delayed = calculate_days_delayed(request_date)
-            
-            if days_delayed < 6:
-                continue
-                
-            request_date_dt = safe_datetime_convert(request_date)
-
-            if days_delayed >= 10:
-                severity = 'critique'
-                message = f"RETARD CRITIQUE: Badge {badge['badge_num']} dépasse 10 jours de traitement ({days_delayed} jours)"
-            elif days_delayed >= 6:
-                severity = 'attention'
-                message = f"ATTENTION: Badge {badge['badge_num']} approche échéance ({days_delayed} jours)"
-            else:
-                continue
+@app.route('/api/search/index', methods=['GET'])
+@require_auth
+def get_search_index_stats():
+    if session['user'].get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    return jsonify({'success': True, 'index': search_index.stats()})
 
-            notifications.append({
-                'id': f"perm_{badge['badge_num']}_{severity}",
-                'type': 'retard',
-                'badge_num': badge['badge_num'],
-                'message': message,
-                'full_name': badge.get('full_name'),
-                'company': badge.get('company'),
-                'severity': severity,
-                'days_delayed': days_delayed,
-                'request_date': request_date_dt.isoformat() if request_date_dt else None
-            })
 
-        # Vérifier les badges temporaires en retard
-        for badge in temporary_badges.find({"dgsn_sent": {"$exists": False}}, {'_id': 0}):
-            request_date = badge.get('request_date')
-            days_delayed = calculate_days_delayed(request_date)
-            
-            if days_delayed < 6:
-                continue
-                
-            request_date_dt = safe_datetime_convert(request_date)
-
-            if days_delayed >= 10:
-                severity = 'critique'
-                message = f"RETARD CRITIQUE: Badge {badge['badge_num']} dépasse 10 jours ({days_delayed} jours)"
-            elif days_delayed >= 6:
-                severity = 'attention'
-                message = f"ATTENTION: Badge {badge['badge_num']} approche échéance ({days_delayed} jours)"
-            else:
-                continue
-
-            notifications.append({
-                'id': f"temp_{badge['badge_num']}_{severity}",
-                'type': 'retard',
-                'badge_num': badge['badge_num'],
-                'message': message,
-                'full_name': badge.get('full_name'),
-                'company': badge.get('company'),
-                'severity': severity,
-                'days_delayed': days_delayed,
-                'request_date': request_date_dt.isoformat() if request_date_dt else None
-            })
+# Replace the existing notifications routes in app.py with this:
 
-        # Badges expirant bientôt (dans 30 jours)
-        # Badges expirant bientôt (dans 30 jours) - ONLY if not resolved
-        expiry_cutoff = today + timedelta(days=30)
-        for badge in temporary_badges.find({}, {'_id': 0}):
-            badge_num = badge['badge_num']
-            
-            # Check if expiry notification is already resolved - MORE ROBUST CHECK
-            resolved_expiry = resolved_notifications.find_one({
-                'badge_num': badge_num,
-                'notification_type': 'expiry'
-            })
-            
-            # Also check if acknowledged in the badge itself (backward compatibility)
-            expiry_acknowledged = badge.get('expiry_acknowledged')
-            
-            if resolved_expiry or expiry_acknowledged:
-                print(f"Skipping expired badge {badge_num} - already resolved/acknowledged")
-                continue  # Skip if already resolved
-                
-            validity_end = badge.get('validity_end')
-            validity_end_dt = safe_datetime_convert(validity_end)
-            
-            if not validity_end_dt:
-                continue
-                
-            # Skip if already expired or too far in future
-            if validity_end_dt <= today or validity_end_dt > expiry_cutoff:
-                continue
-                
-            days_remaining = (validity_end_dt - today).days
-            
-            # Double-check: don't create notification if it's already resolved
-            notification_id = f"exp_{badge_num}"
-            
-            notifications.append({
-                'id': notification_id,
-                'type': 'expiration',
-                'badge_num': badge_num,
-                'message': f"Badge {badge_num} expire dans {days_remaining} jours",
-                'full_name': badge.get('full_name'),
-                'company': badge.get('company'),
-                'severity': 'info',
-                'days_remaining': days_remaining,
-                'expiry_date': validity_end_dt.isoformat()
-            })
-            
-            print(f"Created expiry notification for badge {badge_num}, {days_remaining} days remaining")
-
-        # Nouveaux badges (dernières 24 heures)
-        new_cutoff = today - timedelta(hours=24)
-        for badge in badge_additions.find({"added_at": {"$gte": new_cutoff}}, {'_id': 0}):
-            notifications.append({
-                'id': f"new_{badge['badge_num']}",
-                'type': 'nouveau',
-                'badge_num': badge['badge_num'],
-                'badge_type': badge['type'],
-                'message': f"Nouveau badge {badge['type']} ajouté: {badge['badge_num']}",
-                'full_name': badge.get('full_name', 'Inconnu'),
-                'company': badge.get('company', 'Inconnu'),
-                'added_by': badge['added_by'],
-                'added_at': badge['added_at'].isoformat() if badge.get('added_at') else 'N/A',
-                'severity': 'info'
-            })
+def open_notifications():
+    # Kept current by the notification generator
+    current, token = notification_store.current(session['user']['username'])
+    return {
+        'notifications': current,
+        'total': len(current),
+        'token': str(token),
+        'last_updated': datetime.now()
+    }
 
-        # Trier par sévérité (critique en premier)
-        severity_order = {'critique': 3, 'attention': 2, 'info': 1}
-        notifications.sort(key=lambda x: severity_order.get(x['severity'], 0), reverse=True)
 
-        response = {
-            'success': True,
-            'notifications': notifications,
-            'total': len(notifications),
-            'last_updated': today.isoformat()
-        }
+@app.route('/api/notifications', methods=['GET'])
+@require_auth
+@conditional_get('notifications')
+def get_notifications():
+    try:
+        if session['user'].get('role') != 'admin':
+            return jsonify({'success': False, 'message': 'Accès administrateur requis'}), 403
 
-        return jsonify(response)
+        since = request.args.get('since')
+        if since:
+            try:
+                delta = notification_store.changes_since(parse_token(since), session['user']['username'])
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+            # Unknown or purged token: the client starts over from the full list
+            if delta is not None:
+                changed, removed, token = delta
+                return jsonify({
+                    'success': True,
+                    'full': False,
+                    'notifications': changed,
+                    'removed': removed,
+                    'token': str(token),
+                    'last_updated': datetime.now()
+                })
+
+        return jsonify({'success': True, 'full': True, **open_notifications()})
         
     except Exception as e:
         app.logger.error(f'Notifications error: {str(e)}')
         return jsonify({'success': False, 'message': 'Échec de récupération des notifications'}), 500
 
+# Seconds between keep-alive comments on an idle notification stream
+NOTIFICATION_HEARTBEAT = int(os.environ.get('NOTIFICATION_HEARTBEAT', 15))
+# How long browsers wait before reconnecting a dropped stream
+NOTIFICATION_RETRY_MS = 5000
+
+
+def sse_event(kind, payload, event_id):
+    return f'id: {event_id}\nevent: {kind}\ndata: {app.json.dumps(payload)}\n\n'
+
+
+@app.route('/api/notifications/stream', methods=['GET'])
+@compress_options(enabled=False)
+@require_auth
+def stream_notifications():
+    """Server-sent events: the open notifications, then their changes.
+
+    Every stream waits on the shared notification feed, so an idle one
+    costs no query. A client reconnecting with Last-Event-ID gets the
+    changes it missed, or a new snapshot when this process no longer has
+    them.
+    """
+    if session['user'].get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Accès administrateur requis'}), 403
+
+    user = session['user']['username']
+    resume_from = notification_feed.parse_event_id(request.headers.get('Last-Event-ID'))
+
+    def events():
+        yield f'retry: {NOTIFICATION_RETRY_MS}\n\n'
+        sequence = resume_from
+        acknowledgements = notification_store.acknowledgements(user)
+        while True:
+            if sequence is None:
+                # Position first: a change racing the snapshot is sent again, which is harmless
+                sequence = notification_feed.position()
+                acknowledgements = notification_store.acknowledgements(user)
+                yield sse_event('snapshot', open_notifications(), notification_feed.event_id(sequence))
+
+            changes = notification_feed.wait(sequence, NOTIFICATION_HEARTBEAT)
+            if changes is None:
+                sequence = None
+            elif not changes:
+                yield ': heartbeat\n\n'
+            for sequence, kind, payload, owner in changes or ():
+                event_id = notification_feed.event_id(sequence)
+                if owner is not None and owner != user:
+                    continue
+                if kind == 'cleared':
+                    # Everything raised until then is acknowledged: start over
+                    sequence = None
+                    break
+                if kind == 'acknowledged':
+                    for notification_id in payload['ids']:
+                        acknowledgements.overrides[notification_id] = payload['at']
+                        yield sse_event('resolved', {'id': notification_id}, event_id)
+                elif kind == 'resolved' or not acknowledgements.hides(payload):
+                    yield sse_event(kind, payload, event_id)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/debug/resolved-notifications', methods=['GET'])
 @require_auth
 def debug_resolved_notifications():
@@ -907,56 +1099,28 @@ def debug_resolved_notifications():
 @require_auth
 def delete_notification(notification_id):
     try:
-        print(f"Deleting notification: {notification_id}")  # DEBUG
-        
         if session['user'].get('role') != 'admin':
             return jsonify({'success': False, 'message': 'Accès administrateur requis'}), 403
 
-        parts = notification_id.split('_')
-        if len(parts) < 2:
-            return jsonify({'success': False, 'message': 'ID de notification invalide'}), 400
-
-        notification_type = parts[0]
-        badge_num = parts[1]
-        
-        print(f"Notification type: {notification_type}, Badge num: {badge_num}")  # DEBUG
-
-        if notification_type == 'new':
-            result = badge_additions.delete_one({'badge_num': badge_num})
-            print(f"Deleted new badge notification: {result.deleted_count}")  # DEBUG
-        
-        elif notification_type in ['perm', 'temp']:
-            collection = permanent_badges if notification_type == 'perm' else temporary_badges
-            result = collection.update_one(
-                {'badge_num': badge_num},
-                {'$set': {'dgsn_sent': datetime.now()}}
+        notification = notifications.find_one({'_id': notification_id, 'deleted_at': None})
+        if not notification:
+            return jsonify({'success': False, 'message': 'Notification introuvable'}), 404
+        acknowledge_notifications({'_id': notification_id})
+
+        # A delay is over once the badge is marked as sent to the DGSN
+        if notification['type'] == 'retard':
+            badge_type = notification['badge_type']
+            now = datetime.now()
+            before = BADGE_COLLECTIONS[badge_type].find_one_and_update(
+                {'badge_num': notification['badge_num'], **UNSENT},
+                {'$set': {'dgsn_sent': now}}
             )
-            print(f"Marked badge as sent: {result.matched_count}")  # DEBUG
-        
-        elif notification_type == 'exp':
-            # For expiry notifications - more robust resolution
-            resolution_data = {
-                'badge_num': badge_num,
-                'notification_type': 'expiry',
-                'resolved_at': datetime.now(),
-                'resolved_by': session['user']['username'],
-                'original_notification_id': notification_id
-            }
-            
-            result = resolved_notifications.insert_one(resolution_data)
-            print(f"Inserted expiry resolution: {result.inserted_id}")  # DEBUG
-            
-            # Also mark in temporary_badges
-            temp_result = temporary_badges.update_one(
-                {'badge_num': badge_num},
-                {'$set': {'expiry_acknowledged': datetime.now()}}
-            )
-            print(f"Updated temporary badge: {temp_result.matched_count}")  # DEBUG
+            if before:
+                record_badge_change(badge_type, before=before, after={**before, 'dgsn_sent': now})
 
         return jsonify({'success': True, 'message': 'Notification supprimée'})
         
     except Exception as e:
-        print(f"Error deleting notification: {e}")  # DEBUG
         app.logger.error(f'Delete notification error: {str(e)}')
         return jsonify({'success': False, 'message': 'Échec de suppression de la notification'}), 500
 
@@ -967,31 +1131,47 @@ def clear_all_notifications():
         if session['user'].get('role') != 'admin':
             return jsonify({'success': False, 'message': 'Accès administrateur requis'}), 403
 
-        # Clear new badge notifications
-        badge_additions.delete_many({})
-        
-        # Mark all delayed badges as sent
-        now = datetime.now()
-        permanent_badges.update_many(
-            {"dgsn_sent": {"$exists": False}},
-            {"$set": {"dgsn_sent": now}}
-        )
-        temporary_badges.update_many(
-            {"dgsn_sent": {"$exists": False}},
-            {"$set": {"dgsn_sent": now}}
-        )
-        
-        # Mark all expiry notifications as acknowledged
-        temporary_badges.update_many(
-            {},
-            {"$set": {"expiry_acknowledged": now}}
-        )
+        # Moves the user's acknowledgement watermark, whatever the number of notifications
+        notification_store.clear(session['user']['username'])
 
         return jsonify({'success': True, 'message': 'Toutes les notifications supprimées'})
         
     except Exception as e:
         app.logger.error(f'Clear all notifications error: {str(e)}')
         return jsonify({'success': False, 'message': 'Échec de suppression des notifications'}), 500
+
+# Notifications acknowledged per request
+MAX_BULK_RESOLVE = 500
+
+
+@app.route('/api/notifications/bulk-resolve', methods=['POST'])
+@require_auth
+def bulk_resolve_notifications():
+    """Acknowledge a list of notifications for the current user in one write.
+
+    Unlike deleting a delay notification, this does not mark its badge as
+    sent to the DGSN.
+    """
+    try:
+        if session['user'].get('role') != 'admin':
+            return jsonify({'success': False, 'message': 'Accès administrateur requis'}), 403
+
+        ids = (request.get_json(silent=True) or {}).get('ids')
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, str) for i in ids):
+            return jsonify({'success': False, 'message': 'ids must be a non-empty list of notification ids'}), 400
+        if len(ids) > MAX_BULK_RESOLVE:
+            return jsonify({'success': False, 'message': f'At most {MAX_BULK_RESOLVE} ids per request'}), 400
+
+        acknowledged = acknowledge_notifications({'_id': {'$in': ids}})
+        return jsonify({
+            'success': True,
+            'resolved': [notification['_id'] for notification in acknowledged],
+            'count': len(acknowledged)
+        })
+
+    except Exception as e:
+        app.logger.error(f'Bulk resolve notifications error: {str(e)}')
+        return jsonify({'success': False, 'message': 'Échec de résolution des notifications'}), 500
 # Remove the resolve notification endpoint since we're not storing resolved notifications anymore
 @app.route('/api/notifications/clear', methods=['POST'])
 @require_auth
@@ -1020,28 +1200,14 @@ def resolve_notification():
             
         if not notification_type:
             return jsonify({'success': False, 'message': 'Notification type is required'}), 400
-        
-        # Check if notification is already resolved to prevent duplicates
-        existing_resolution = resolved_notifications.find_one({
-            'badge_num': badge_num,
-            'type': notification_type
-        })
-        
-        if existing_resolution:
+
+        if not acknowledge_notifications({'badge_num': badge_num, 'type': notification_type}):
             return jsonify({
                 'success': True, 
                 'message': 'Notification already resolved',
                 'already_resolved': True
             })
         
-        # Insert the resolved notification
-        resolved_notifications.insert_one({
-            'badge_num': badge_num,
-            'type': notification_type,
-            'resolved_at': datetime.now(),
-            'resolved_by': session['user']['username']
-        })
-        
         app.logger.info(f"Notification resolved - Badge: {badge_num}, Type: {notification_type}, By: {session['user']['username']}")
         
         return jsonify({
@@ -1073,6 +1239,8 @@ def acknowledge_new_badge():
         
         if result.matched_count == 0:
             return jsonify({'success': False, 'message': 'Notification not found'}), 404
+
+        acknowledge_notifications({'_id': f'new_{badge_num}'})
         
         return jsonify({'success': True})
     except Exception as e:
@@ -1081,133 +1249,84 @@ def acknowledge_new_badge():
 
 @app.route('/api/badges/permanent', methods=['GET'])
 @require_auth
+@conditional_get('permanent_badges')
 def get_permanent_badges():
     try:
-        badges = list(permanent_badges.find({}, {'_id': 0}))
-        
-        # Add enhanced processing status and validity status to each badge
-        for badge in badges:
-            badge['processing_status'] = get_permanent_processing_status(badge)
-            badge['validity_status'] = get_permanent_validity_status(badge)
-            
-            # Convert dates to ISO format for frontend
-            for field in ['request_date', 'dgsn_sent_date', 'dgsn_return_date', 'gr_sent_date', 'gr_return_date']:
-                if field in badge and isinstance(badge[field], datetime):
-                    badge[field] = badge[field].isoformat()
-                    
-        return jsonify({'success': True, 'badges': badges})
+        return list_badges('permanent', permanent_list_entries)
     except Exception as e:
         app.logger.error(f'Get permanent badges error: {str(e)}')
         return jsonify({'success': False, 'message': 'Failed to fetch permanent badges'}), 500
 
+def permanent_list_entries(badges, fields=None):
+    now = datetime.now()
+    entries = []
+    for badge in badges:
+        badge.pop('_id', None)
+
+        # Add enhanced processing status and validity status, from the stored states
+        if wants(fields, 'processing_status'):
+            badge['processing_status'] = get_permanent_processing_status(
+                badge.get('processing_state'), processing_days(badge, now)
+            )
+        if wants(fields, 'validity_status'):
+            state = badge.get('validity_state')
+            validity_end = as_date(badge.get('effective_validity_end'))
+            badge['validity_status'] = get_permanent_validity_status(
+                state, validity_status_days(state, validity_end, now), validity_end
+            )
+        entries.append(select(badge, fields))
+    return entries
+
 @app.route('/api/badges/permanent/<badge_num>', methods=['GET'])
 @require_auth
+@conditional_get('permanent_badges')
 def get_permanent_badge(badge_num):
     try:
-        badge = permanent_badges.find_one({'badge_num': badge_num}, {'_id': 0})
+        try:
+            fields = requested_fields(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        badge = permanent_badges.find_one({'badge_num': badge_num}, {**projection(fields, 'permanent'), '_id': 0})
         if not badge:
             return jsonify({'success': False, 'message': 'Badge not found'}), 404
-        
-        # Add enhanced processing status and validity status
-        badge['processing_status'] = get_permanent_processing_status(badge)
-        badge['validity_status'] = get_permanent_validity_status(badge)
-        
-        # Convert dates to ISO format for frontend
-        for field in ['request_date', 'dgsn_sent_date', 'dgsn_return_date', 'gr_sent_date', 'gr_return_date']:
-            if field in badge and isinstance(badge[field], datetime):
-                badge[field] = badge[field].isoformat()
-                
-        return jsonify({'success': True, **badge})
+
+        return jsonify({'success': True, **permanent_list_entries([badge], fields)[0]})
     except Exception as e:
         app.logger.error(f'Get permanent badge error: {str(e)}')
         return jsonify({'success': False, 'message': 'Failed to fetch badge'}), 500
 
-def get_permanent_processing_status(badge):
-    """Calculate processing status for permanent badges with proper days count"""
-    today = datetime.now()
-    
-    if not badge.get('request_date'):
+def get_permanent_processing_status(state, days):
+    """Processing status for permanent badges, from the stored processing_state"""
+    if state == 'no-date':
         return { 'days': 0, 'status': 'no-date', 'message': 'N/A' }
     
-    # Handle string dates
-    request_date = badge.get('request_date')
-    if isinstance(request_date, str):
-        try:
-            request_date = datetime.fromisoformat(request_date.replace('Z', '+00:00'))
-        except:
-            return { 'days': 0, 'status': 'no-date', 'message': 'N/A' }
-    
-    # Check if badge is completed (has gr_return_date)
-    if badge.get('gr_return_date'):
-        gr_return_date = badge.get('gr_return_date')
-        if isinstance(gr_return_date, str):
-            try:
-                gr_return_date = datetime.fromisoformat(gr_return_date.replace('Z', '+00:00'))
-            except:
-                gr_return_date = None
-        
-        if gr_return_date:
-            processing_days = (gr_return_date - request_date).days
-            return { 
-                'days': processing_days, 
-                'status': 'completed', 
-                'message': f'{processing_days}j'
-            }
-    
-    # Active processing status based on days since request
-    diff_days = (today - request_date).days
-    
+    # Completed: days from request to gr_return_date; otherwise days since request
     return { 
-        'days': diff_days, 
-        'status': 'processing', 
-        'message': f'{diff_days}j'
+        'days': days, 
+        'status': state, 
+        'message': f'{days}j'
     }
 
 
-def get_permanent_validity_status(badge):
-    """Calculate validity status for permanent badges based on GR return date"""
-    today = datetime.now()
-    
-    if not badge.get('gr_return_date'):
+def get_permanent_validity_status(state, days, validity_end):
+    """Validity status for permanent badges, from the stored validity_state"""
+    if state == 'pending':
         return { 'status': 'pending', 'message': 'En attente', 'valid': False }
-    
-    # Handle GR return date
-    gr_return_date = badge.get('gr_return_date')
-    if isinstance(gr_return_date, str):
-        try:
-            gr_return_date = datetime.fromisoformat(gr_return_date.replace('Z', '+00:00'))
-        except:
-            return { 'status': 'unknown', 'message': 'Date invalide', 'valid': False }
-    
-    if not isinstance(gr_return_date, datetime):
+    if state == 'unknown':
         return { 'status': 'unknown', 'message': 'Date invalide', 'valid': False }
     
-    # Calculate validity end date based on validity_duration
-    validity_duration = badge.get('validity_duration', '1 year')
-    
-    if validity_duration == '1 year':
-        validity_end = gr_return_date + timedelta(days=365)
-    elif validity_duration == '3 years':
-        validity_end = gr_return_date + timedelta(days=365*3)
-    elif validity_duration == '5 years':
-        validity_end = gr_return_date + timedelta(days=365*5)
-    else:
-        validity_end = gr_return_date + timedelta(days=365)  # Default to 1 year
-    
-    # Check validity status
-    if today > validity_end:
-        days_expired = (today - validity_end).days
+    if state == 'expired':
         return { 
             'status': 'expired', 
-            'message': f'Expiré ({days_expired}j)', 
+            'message': f'Expiré ({days}j)', 
             'valid': False,
             'validity_end': validity_end
         }
     else:
-        days_remaining = (validity_end - today).days
         return { 
             'status': 'valid', 
-            'message': f'Valide ({days_remaining}j restants)', 
+            'message': f'Valide ({days}j restants)', 
             'valid': True,
             'validity_end': validity_end
         }
@@ -1249,8 +1368,15 @@ def create_permanent_badge():
         if permanent_badges.find_one({'badge_num': data['badge_num']}):
             return jsonify({'success': False, 'message': 'Badge number already exists'}), 400
         
+        try:
+            normalize_dates('permanent', data)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+        if not data['request_date']:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+
         # حساب تاريخ الصلاحية (validity_end) بناءً على المدة
-        request_date = datetime.fromisoformat(data['request_date'])
+        request_date = data['request_date']
         validity_duration = data.get('validity_duration', '1 year')
 
         if validity_duration == '1 year':
@@ -1262,11 +1388,14 @@ def create_permanent_badge():
         else:
             validity_end = request_date + timedelta(days=365)  # Default to 1 year if not provided
 
-        data['validity_end'] = validity_end.isoformat()  # إضافة تاريخ الصلاحية (validity_end)
+        data['validity_end'] = validity_end  # إضافة تاريخ الصلاحية (validity_end)
+        data['effective_validity_end'] = permanent_validity_end(data)
+        data.update(status_fields('permanent', data))
+        data.update(search_fields(data))
 
         # تخزين البادج في قاعدة البيانات
-        data['request_date'] = request_date
         permanent_badges.insert_one(data)
+        record_badge_change('permanent', after=data)
         
         badge_additions.insert_one({
             'badge_num': data['badge_num'],
@@ -1286,6 +1415,10 @@ def create_permanent_badge():
 def update_permanent_badge(old_badge_num):
     try:
         data = request.get_json()
+        try:
+            normalize_dates('permanent', data)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Format de date invalide'}), 400
         
         # Check if badge exists
         existing_badge = permanent_badges.find_one({'badge_num': old_badge_num})
@@ -1306,8 +1439,18 @@ def update_permanent_badge(old_badge_num):
             if recovered_badges.find_one({'badge_num': new_badge_num}):
                 return jsonify({'success': False, 'message': 'Le numéro de badge existe déjà dans les badges récupérés'}), 400
         
+        # Keep the stored end of validity in step with gr_return_date/validity_duration
+        data['effective_validity_end'] = permanent_validity_end({**existing_badge, **data})
+        data.update(status_fields('permanent', {**existing_badge, **data}))
+        data.update(search_fields({**existing_badge, **data}))
+
         # Update the badge
-        permanent_badges.update_one({'badge_num': old_badge_num}, {'$set': data})
+        updated_badge = permanent_badges.find_one_and_update(
+            {'badge_num': old_badge_num},
+            {'$set': data},
+            return_document=ReturnDocument.AFTER
+        )
+        record_badge_change('permanent', before=existing_badge, after=updated_badge)
         
         # If badge number was changed, update related records
         if new_badge_num and new_badge_num != old_badge_num:
@@ -1457,6 +1600,7 @@ def delete_contract(badge_type, badge_num):
         
 
 @app.route('/api/badges/contract/<badge_num>', methods=['GET'])
+@compress_options(enabled=False)
 @require_auth
 def download_contract_legacy(badge_num):
     try:
@@ -1519,6 +1663,7 @@ def has_contract(badge_type, badge_num):
 # In app.py - Update the download_contract function
 # Updated download contract route for all badge types
 @app.route('/api/badges/<badge_type>/<badge_num>/contract', methods=['GET'])
+@compress_options(enabled=False)
 @require_auth
 def download_contract_universal(badge_type, badge_num):
     try:
@@ -1557,9 +1702,10 @@ def download_contract_universal(badge_type, badge_num):
 @require_auth
 def delete_permanent_badge(badge_num):
     try:
-        result = permanent_badges.delete_one({'badge_num': badge_num})
-        if result.deleted_count == 0:
+        deleted_badge = permanent_badges.find_one_and_delete({'badge_num': badge_num})
+        if not deleted_badge:
             return jsonify({'success': False, 'message': 'Badge not found'}), 404
+        record_badge_change('permanent', before=deleted_badge)
         
         badge_additions.delete_one({'badge_num': badge_num})
         resolved_notifications.delete_many({'badge_num': badge_num})
@@ -1569,53 +1715,34 @@ def delete_permanent_badge(badge_num):
         app.logger.error(f'Delete permanent badge error: {str(e)}')
         return jsonify({'success': False, 'message': 'Failed to delete permanent badge'}), 500
     
-def get_temporary_badge_status(badge):
-    """Enhanced status calculation for temporary badges similar to permanent badges"""
-    today = datetime.now()
-    
-    if not badge.get('request_date'):
-        return { 'days': 0, 'status': 'no-date', 'color': 'text-gray-600', 'bg': 'bg-gray-100' }
+def get_temporary_badge_status(state, diffDays):
+    """Processing status for temporary badges, from the stored processing_state.
 
-    # Handle string dates
-    request_date = badge.get('request_date')
-    if isinstance(request_date, str):
-        try:
-            request_date = datetime.fromisoformat(request_date.replace('Z', '+00:00'))
-        except:
-            return { 'days': 0, 'status': 'no-date', 'color': 'text-gray-600', 'bg': 'bg-gray-100' }
-    
-    # Calculate days since request
-    diffDays = (today - request_date).days
+    ``diffDays`` counts from the request to gr_return_date once completed,
+    else up to today.
+    """
+    if state == 'no-date':
+        return { 'days': 0, 'status': 'no-date', 'color': 'text-gray-600', 'bg': 'bg-gray-100' }
 
-    # Check if badge is completed (has gr_return_date)
-    if badge.get('gr_return_date'):
-        gr_return_date = badge.get('gr_return_date')
-        if isinstance(gr_return_date, str):
-            try:
-                gr_return_date = datetime.fromisoformat(gr_return_date.replace('Z', '+00:00'))
-            except:
-                gr_return_date = None
-        
-        if gr_return_date:
-            processing_days = (gr_return_date - request_date).days
-            if processing_days > 10:
-                return { 
-                    'days': processing_days, 
-                    'status': 'completed-invalid', 
-                    'color': 'text-red-600', 
-                    'bg': 'bg-red-100',
-                    'message': f'Invalid ({processing_days} days)'
-                }
+    if state in ('completed', 'completed-invalid'):
+        processing_days = diffDays
+        if state == 'completed-invalid':
             return { 
                 'days': processing_days, 
-                'status': 'completed', 
-                'color': 'text-green-600', 
-                'bg': 'bg-green-100',
-                'message': f'Complete ({processing_days} days)'
+                'status': 'completed-invalid', 
+                'color': 'text-red-600', 
+                'bg': 'bg-red-100',
+                'message': f'Invalid ({processing_days} days)'
             }
+        return { 
+            'days': processing_days, 
+            'status': 'completed', 
+            'color': 'text-green-600', 
+            'bg': 'bg-green-100',
+            'message': f'Complete ({processing_days} days)'
+        }
 
-    # Active processing status based on days since request
-    if diffDays >= 10:
+    if state == 'expired':
         return { 
             'days': diffDays, 
             'status': 'expired', 
@@ -1623,7 +1750,7 @@ def get_temporary_badge_status(badge):
             'bg': 'bg-red-200',
             'message': f'🚨 EXPIRED ({diffDays} days)'
         }
-    elif diffDays >= 9:
+    elif state == 'critical':
         return { 
             'days': diffDays, 
             'status': 'critical', 
@@ -1631,7 +1758,7 @@ def get_temporary_badge_status(badge):
             'bg': 'bg-red-100',
             'message': f'🚨 CRITICAL ({diffDays} days)'
         }
-    elif diffDays >= 6:
+    elif state == 'warning':
         return { 
             'days': diffDays, 
             'status': 'warning', 
@@ -1651,43 +1778,45 @@ def get_temporary_badge_status(badge):
 
 @app.route('/api/badges/temporary', methods=['GET'])
 @require_auth
+@conditional_get('temporary_badges')
 def get_temporary_badges():
     try:
-        badges = list(temporary_badges.find({}, {'_id': 0}))
-        
-        # Add enhanced status to each badge
-        for badge in badges:
-            badge['status'] = update_badge_status(badge)
-            badge['processing_status'] = get_temporary_badge_status(badge)
-            
-            # Convert dates to ISO format for frontend
-            for field in ['request_date', 'dgsn_sent_date', 'dgsn_return_date', 'gr_sent_date', 'gr_return_date', 'validity_start', 'validity_end']:
-                if field in badge and isinstance(badge[field], datetime):
-                    badge[field] = badge[field].isoformat()
-                    
-        return jsonify({'success': True, 'badges': badges})
+        return list_badges('temporary', temporary_list_entries)
     except Exception as e:
         app.logger.error(f'Get temporary badges error: {str(e)}')
         return jsonify({'success': False, 'message': 'Failed to fetch temporary badges'}), 500
 
 
+def temporary_list_entries(badges, fields=None):
+    now = datetime.now()
+    entries = []
+    for badge in badges:
+        badge.pop('_id', None)
+
+        # Add enhanced status; ``status`` itself is stored as it is served
+        if wants(fields, 'processing_status'):
+            badge['processing_status'] = get_temporary_badge_status(
+                badge.get('processing_state'), processing_days(badge, now)
+            )
+        entries.append(select(badge, fields))
+    return entries
+
+
 @app.route('/api/badges/temporary/<badge_num>', methods=['GET'])
 @require_auth
+@conditional_get('temporary_badges')
 def get_temporary_badge_details(badge_num):
     try:
-        badge = temporary_badges.find_one({'badge_num': badge_num}, {'_id': 0})
+        try:
+            fields = requested_fields(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        badge = temporary_badges.find_one({'badge_num': badge_num}, {**projection(fields, 'temporary'), '_id': 0})
         if not badge:
             return jsonify({'success': False, 'message': 'Badge not found'}), 404
-            
-        badge['status'] = update_badge_status(badge)
-        badge['processing_status'] = get_temporary_badge_status(badge)
-        
-        # Convert dates to ISO format for frontend
-        for field in ['request_date', 'dgsn_sent_date', 'dgsn_return_date', 'gr_sent_date', 'gr_return_date', 'validity_start', 'validity_end']:
-            if field in badge and isinstance(badge[field], datetime):
-                badge[field] = badge[field].isoformat()
-                
-        return jsonify({'success': True, 'badge': badge})
+
+        return jsonify({'success': True, 'badge': temporary_list_entries([badge], fields)[0]})
     except Exception as e:
         app.logger.error(f'Error fetching temporary badge details: {str(e)}')
         return jsonify({'success': False, 'message': 'Failed to fetch badge details'}), 500
@@ -1702,15 +1831,23 @@ def create_temporary_badge():
         if not data or not all(field in data for field in required_fields):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
 
+        try:
+            normalize_dates('temporary', data)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+        if not data['request_date']:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+
         # Set verification_date
         if data.get('gr_return_date'):
             data['verification_date'] = data['gr_return_date']
         else:
-            request_date = datetime.fromisoformat(data['request_date'].replace('Z', '+00:00'))
-            data['verification_date'] = (request_date + timedelta(days=10)).isoformat()
+            data['verification_date'] = data['request_date'] + timedelta(days=10)
 
-        data['status'] = update_badge_status(data)
+        data.update(status_fields('temporary', data))
+        data.update(search_fields(data))
         temporary_badges.insert_one(data)
+        record_badge_change('temporary', after=data)
         return jsonify({'success': True, 'message': 'Temporary badge created'}), 201
     except Exception as e:
         app.logger.error(f'Error creating temporary badge: {str(e)}')
@@ -1722,6 +1859,10 @@ def create_temporary_badge():
 def update_temporary_badge(old_badge_num):
     try:
         data = request.get_json()
+        try:
+            normalize_dates('temporary', data)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Format de date invalide'}), 400
         
         # Check if badge exists
         existing_badge = temporary_badges.find_one({'badge_num': old_badge_num})
@@ -1742,8 +1883,17 @@ def update_temporary_badge(old_badge_num):
             if recovered_badges.find_one({'badge_num': new_badge_num}):
                 return jsonify({'success': False, 'message': 'Le numéro de badge existe déjà dans les badges récupérés'}), 400
         
+        # Keep the stored statuses in step with the new dates
+        data.update(status_fields('temporary', {**existing_badge, **data}))
+        data.update(search_fields({**existing_badge, **data}))
+
         # Update the badge
-        temporary_badges.update_one({'badge_num': old_badge_num}, {'$set': data})
+        updated_badge = temporary_badges.find_one_and_update(
+            {'badge_num': old_badge_num},
+            {'$set': data},
+            return_document=ReturnDocument.AFTER
+        )
+        record_badge_change('temporary', before=existing_badge, after=updated_badge)
         
         # If badge number was changed, update related records
         if new_badge_num and new_badge_num != old_badge_num:
@@ -1766,9 +1916,10 @@ def update_temporary_badge(old_badge_num):
 @require_auth
 def delete_temporary_badge(badge_num):
     try:
-        result = temporary_badges.delete_one({'badge_num': badge_num})
-        if result.deleted_count == 0:
+        deleted_badge = temporary_badges.find_one_and_delete({'badge_num': badge_num})
+        if not deleted_badge:
             return jsonify({'success': False, 'message': 'Badge not found'}), 404
+        record_badge_change('temporary', before=deleted_badge)
         
         badge_additions.delete_one({'badge_num': badge_num})
         resolved_notifications.delete_many({'badge_num': badge_num})
@@ -1779,26 +1930,18 @@ def delete_temporary_badge(badge_num):
 
 @app.route('/api/badges/recovered', methods=['GET'])
 @require_auth
+@conditional_get('recovered_badges')
 def get_recovered_badges():
     try:
-        # Fetch all recovered badges
-        badges = list(recovered_badges.find({}))
-
-        # Process badges to convert dates and fix encoding
-        for badge in badges:
-            badge['_id'] = str(badge['_id'])
-            badge = fix_encoding_comprehensive(badge)
-            
-            for field in ['recovery_date', 'validity_start', 'validity_end', 'request_date']:
-                if field in badge and isinstance(badge[field], datetime):
-                    badge[field] = badge[field].isoformat()
-
-        return jsonify({'success': True, 'badges': badges})
+        return list_badges('recovered', recovered_list_entries)
 
     except Exception as e:
         app.logger.error(f'Get recovered badges error: {str(e)}')
         return jsonify({'success': False, 'message': 'Failed to fetch recovered badges'}), 500
 
+def recovered_list_entries(badges, fields=None):
+    return [select(fix_encoding_comprehensive(badge), fields) for badge in badges]
+
 @app.route('/api/badges/recovered', methods=['POST'])
 @require_auth
 def create_recovered_badge():
@@ -1811,6 +1954,14 @@ def create_recovered_badge():
         if not all(field in data for field in required_fields):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
 
+        # Store every date as a BSON date
+        try:
+            normalize_dates('recovered', data)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+        if not data['recovery_date']:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+
         # Specific validation for 'renouvellement'
         if data.get('recovery_type') == 'renouvellement':
             if not data.get('badge_type'):
@@ -1821,16 +1972,9 @@ def create_recovered_badge():
                 if not data.get('validity_start') or not data.get('validity_end'):
                     return jsonify({'success': False, 'message': 'Validity start and end dates are required for temporary badge renewal'}), 400
                 
-                # Validate date format and logic
-                try:
-                    start_date = datetime.fromisoformat(data['validity_start'].replace('Z', '+00:00'))
-                    end_date = datetime.fromisoformat(data['validity_end'].replace('Z', '+00:00'))
-                    
-                    if start_date >= end_date:
-                        return jsonify({'success': False, 'message': 'Validity end date must be after start date'}), 400
-                        
-                except ValueError:
-                    return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+                # Validate date logic
+                if data['validity_start'] >= data['validity_end']:
+                    return jsonify({'success': False, 'message': 'Validity end date must be after start date'}), 400
             
             # Validate permanent badge requirements
             elif data.get('badge_type') == 'permanent':
@@ -1858,25 +2002,14 @@ def create_recovered_badge():
         if recovered_badges.find_one({'badge_num': data['badge_num']}):
             return jsonify({'success': False, 'message': 'Badge number already exists in recovered badges'}), 400
 
-        # Convert dates to datetime objects for storage
-        try:
-            data['recovery_date'] = datetime.fromisoformat(data['recovery_date'].replace('Z', '+00:00'))
-            
-            if data.get('validity_start'):
-                data['validity_start'] = datetime.fromisoformat(data['validity_start'].replace('Z', '+00:00'))
-            
-            if data.get('validity_end'):
-                data['validity_end'] = datetime.fromisoformat(data['validity_end'].replace('Z', '+00:00'))
-                
-        except ValueError:
-            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
-
         # Add metadata
         data['created_at'] = datetime.now()
         data['created_by'] = session['user']['username']
+        data.update(search_fields(data))
 
         # Insert the badge data into the database
         recovered_badges.insert_one(data)
+        record_badge_change('recovered', after=data)
 
         # Add to badge additions for notifications
         badge_additions.insert_one({
@@ -1901,6 +2034,10 @@ def update_recovered_badge(old_badge_num):
     try:
         data = request.get_json()
         data = fix_encoding_comprehensive(data)
+        try:
+            normalize_dates('recovered', data)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Format de date invalide'}), 400
         
         # Check if badge exists
         existing_badge = recovered_badges.find_one({'badge_num': old_badge_num})
@@ -1921,8 +2058,15 @@ def update_recovered_badge(old_badge_num):
             if temporary_badges.find_one({'badge_num': new_badge_num}):
                 return jsonify({'success': False, 'message': 'Le numéro de badge existe déjà dans les badges temporaires'}), 400
         
+        data.update(search_fields({**existing_badge, **data}))
+
         # Update the badge
-        recovered_badges.update_one({'badge_num': old_badge_num}, {'$set': data})
+        updated_badge = recovered_badges.find_one_and_update(
+            {'badge_num': old_badge_num},
+            {'$set': data},
+            return_document=ReturnDocument.AFTER
+        )
+        record_badge_change('recovered', before=existing_badge, after=updated_badge)
         
         # If badge number was changed, update related records
         if new_badge_num and new_badge_num != old_badge_num:
@@ -1956,11 +2100,18 @@ def get_recovered_count():
 
 @app.route('/api/badges/recovered/<badge_num>', methods=['GET'])
 @require_auth
+@conditional_get('recovered_badges')
 def get_recovered_badge(badge_num):
     try:
-        badge = recovered_badges.find_one({'badge_num': badge_num}, {'_id': 0})
+        try:
+            fields = requested_fields(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        badge = recovered_badges.find_one({'badge_num': badge_num}, {**projection(fields, 'recovered'), '_id': 0})
         if not badge:
             return jsonify({'success': False, 'message': 'Badge not found'}), 404
+        badge = select(badge, fields)
         return jsonify({'success': True, **badge})
     except Exception as e:
         app.logger.error(f'Get recovered badge error: {str(e)}')
@@ -1973,9 +2124,10 @@ def get_recovered_badge(badge_num):
 def delete_recovered_badge(badge_num):
     try:
         # Delete the badge from the 'recovered_badges' collection
-        result = recovered_badges.delete_one({'badge_num': badge_num})
-        if result.deleted_count == 0:
+        deleted_badge = recovered_badges.find_one_and_delete({'badge_num': badge_num})
+        if not deleted_badge:
             return jsonify({'success': False, 'message': 'Badge not found'}), 404
+        record_badge_change('recovered', before=deleted_badge)
 
         # Remove related data from other collections
         badge_additions.delete_one({'badge_num': badge_num})
@@ -2000,4 +2152,8 @@ def get_temporary_count():
     return jsonify({'count': count})
 
 if __name__ == '__main__':
+    # The reloader runs this module in a parent process that only watches the
+    # files; the periodic workers belong to the child that serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_periodic_workers()
     app.run(host="127.0.0.1",debug=True, port=5454)
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""Stored, incrementally refreshed badge statuses.
+
+Statuses only move when the clock crosses a boundary (6/9/10 days after the
+request, the end of validity, ...). The rules live in ``batch_status``,
+which classifies a batch of badges and gives the next such boundary as
+``next_status_change_at``. Write routes store both through
+``status_fields``, and ``sweep_status_fields`` re-classifies only the badges
+whose boundary has passed, found through an index on that field. Read paths
+serve the stored states and only count days themselves.
+"""
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from batch_status import classify_permanent, classify_temporary
+from dates import as_date
+
+
+PROCESSING_STATES = {
+    'permanent': ('no-date', 'completed', 'processing'),
+    'temporary': ('no-date', 'completed', 'completed-invalid', 'normal', 'warning', 'critical', 'expired'),
+}
+VALIDITY_STATES = ('pending', 'unknown', 'valid', 'expired')
+
+# Classifier per badge type, and the states of its result that are stored
+CLASSIFIERS = {
+    'permanent': (classify_permanent, ('processing_state', 'validity_state')),
+    'temporary': (classify_temporary, ('status', 'processing_state')),
+}
+
+
+def batch_status_fields(badge_type, badges, now):
+    """Stored status fields for each of ``badges``, classified in one pass"""
+    classify, states = CLASSIFIERS[badge_type]
+    columns = classify(badges, now)
+    names = states + ('next_status_change_at',)
+    return [{name: columns[name][i] for name in names} for i in range(len(badges))]
+
+
+def status_fields(badge_type, badge, now=None):
+    """Stored status fields for ``badge``; empty for badge types without any"""
+    if badge_type not in CLASSIFIERS:
+        return {}
+    return batch_status_fields(badge_type, [badge], now or datetime.now())[0]
+
+
+def processing_days(badge, now):
+    """Days from the request to the GR return, or to ``now`` while it is awaited"""
+    request_date = as_date(badge.get('request_date'))
+    if not request_date:
+        return 0
+    return ((as_date(badge.get('gr_return_date')) or now) - request_date).days
+
+
+def validity_status_days(validity_state, validity_end, now):
+    """Days since an expired badge ended, or left before a valid one does"""
+    if validity_state not in ('valid', 'expired') or not validity_end:
+        return 0
+    days = (now - validity_end).days if validity_state == 'expired' else (validity_end - now).days
+    # The stored state may trail the clock until the next sweep
+    return max(days, 0)
+
+
+def ensure_status_field_indexes(collections):
+    for badge_type in CLASSIFIERS:
+        collection = collections[badge_type]
+        collection.create_index([('next_status_change_at', 1)])
+        collection.create_index([('processing_state', 1), ('_id', 1)])
+    collections['permanent'].create_index([('validity_state', 1), ('_id', 1)])
+
+
+def _refresh(collection, badge_type, query, now, batch_size):
+    """Re-classify the documents matching ``query``; returns how many changed"""
+    changed = 0
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else {'$and': [query, {'_id': {'$gt': last_id}}]}
+        batch = list(collection.find(batch_query).sort('_id', 1).limit(batch_size))
+        if not batch:
+            return changed
+
+        operations = []
+        for badge, fields in zip(batch, batch_status_fields(badge_type, batch, now)):
+            if any(badge.get(field, ...) != value for field, value in fields.items()):
+                # Only if the boundary is unchanged, so a concurrent write wins
+                operations.append(UpdateOne(
+                    {'_id': badge['_id'], 'next_status_change_at': badge.get('next_status_change_at')},
+                    {'$set': fields}
+                ))
+        if operations:
+            changed += collection.bulk_write(operations, ordered=False).modified_count
+        last_id = batch[-1]['_id']
+
+
+def sweep_status_fields(collections, now=None, batch_size=500):
+    """Flip the badges whose status boundary has passed.
+
+    Returns {badge_type: documents changed}.
+    """
+    now = now or datetime.now()
+    due = {'next_status_change_at': {'$lte': now}}
+    return {
+        badge_type: _refresh(collections[badge_type], badge_type, due, now, batch_size)
+        for badge_type in CLASSIFIERS
+    }
+
+
+def backfill_status_fields(collections, batch_size=500):
+    """Classify badges written before statuses were stored"""
+    now = datetime.now()
+    missing = {'next_status_change_at': {'$exists': False}}
+    return {
+        badge_type: _refresh(collections[badge_type], badge_type, missing, now, batch_size)
+        for badge_type in CLASSIFIERS
+    }
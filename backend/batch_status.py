@@ -0,0 +1,186 @@
+"""Badge status rules, vectorized over batches of badges.
+
+This is the one place the statuses are defined; ``badge_status`` stores its
+results and refreshes them. The dates of a batch become ``datetime64[us]``
+arrays (missing or non-date values are NaT) and every state, day count and
+next boundary is computed in one NumPy pass instead of branching per
+document. Day counts follow ``timedelta.days`` (floor).
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from stats import validity_days
+
+
+# Days since the request at which an unfinished temporary badge turns
+# warning, critical and expired
+TEMPORARY_WARNING_DAYS = 6
+TEMPORARY_CRITICAL_DAYS = 9
+TEMPORARY_EXPIRED_DAYS = 10
+# Days after verification before a temporary badge is expired
+VERIFICATION_DAYS = 10
+
+DAY_US = 86400 * 10**6
+EPOCH = datetime(1970, 1, 1)
+ONE_US = timedelta(microseconds=1)
+NAT = np.iinfo('int64').min
+NO_BOUNDARY = np.iinfo('int64').max
+# Strict comparisons flip just after the boundary itself
+AFTER = np.timedelta64(1, 'us')
+
+
+def date_column(badges, field):
+    # Going through int64 microseconds is several times faster than letting
+    # NumPy convert datetime objects one by one
+    values = (badge.get(field) for badge in badges)
+    return np.array(
+        [(value - EPOCH) // ONE_US if isinstance(value, datetime) else NAT for value in values],
+        dtype='int64'
+    ).view('datetime64[us]')
+
+
+def _days(start, end):
+    """Whole days from start to end, per element; meaningless where either is NaT"""
+    return np.floor_divide((end - start).astype('int64'), DAY_US)
+
+
+def _next_boundary(now, boundaries):
+    """Earliest of the ``boundaries`` columns after ``now``, per element; NaT when none"""
+    stacked = np.stack(boundaries).view('int64')
+    # NaT is the smallest int64, never after now
+    upcoming = np.where(stacked > np.datetime64(now, 'us').astype('int64'), stacked, NO_BOUNDARY)
+    earliest = upcoming.min(axis=0)
+    return np.where(earliest == NO_BOUNDARY, NAT, earliest).view('datetime64[us]')
+
+
+def classify_permanent_columns(request_date, gr_return_date, has_return, effective_validity_end,
+                               duration_days, now):
+    """Processing and validity states of permanent badges.
+
+    ``has_return`` tells which badges have any gr_return_date at all: one
+    that is not a date is NaT in ``gr_return_date`` but makes the validity
+    unknown rather than pending.
+    ``duration_days`` is the validity length in days of each badge, used
+    where ``effective_validity_end`` is missing. Returns a dict of arrays:
+    processing_state, processing_days, validity_state, validity_days
+    (days expired or remaining), validity_end and next_status_change_at.
+    """
+    now = np.datetime64(now, 'us')
+    has_request = ~np.isnat(request_date)
+    returned = ~np.isnat(gr_return_date)
+
+    processing_state = np.select(
+        [~has_request, returned], ['no-date', 'completed'], default='processing'
+    )
+    processing_days = np.select(
+        [~has_request, returned],
+        [0, _days(request_date, gr_return_date)],
+        default=_days(request_date, now)
+    )
+
+    computed_end = gr_return_date + duration_days.astype('timedelta64[D]')
+    validity_end = np.where(np.isnat(effective_validity_end), computed_end, effective_validity_end)
+    has_end = ~np.isnat(validity_end)
+    expired = has_end & (now > validity_end)
+    validity_state = np.select(
+        [~has_return, ~has_end, expired], ['pending', 'unknown', 'expired'], default='valid'
+    )
+    validity_days = np.select(
+        [~has_end, expired], [0, _days(validity_end, now)], default=_days(now, validity_end)
+    )
+
+    validity_end = np.where(has_return, validity_end, np.datetime64('NaT', 'us'))
+    return {
+        'processing_state': processing_state,
+        'processing_days': processing_days,
+        'validity_state': validity_state,
+        'validity_days': validity_days,
+        'validity_end': validity_end,
+        # The processing state never moves with the clock
+        'next_status_change_at': _next_boundary(now, [validity_end + AFTER]),
+    }
+
+
+def classify_temporary_columns(request_date, gr_return_date, verification_date, validity_end, now):
+    """Status, processing state, processing days and next_status_change_at of temporary badges"""
+    now = np.datetime64(now, 'us')
+    has_request = ~np.isnat(request_date)
+    has_return = ~np.isnat(gr_return_date)
+    has_verification = ~np.isnat(verification_date)
+    has_end = ~np.isnat(validity_end)
+
+    status = np.select(
+        [
+            has_verification & (_days(verification_date, now) > VERIFICATION_DAYS),
+            has_end & (now < validity_end),
+            has_verification & has_end & (now <= validity_end),
+            has_end & (now > validity_end),
+        ],
+        ['Expired', 'Processing', 'Active', 'Expired'],
+        default='Unknown'
+    )
+
+    completed_days = _days(request_date, gr_return_date)
+    waiting_days = _days(request_date, now)
+    processing_state = np.select(
+        [
+            ~has_request,
+            has_return & (completed_days > TEMPORARY_EXPIRED_DAYS),
+            has_return,
+            waiting_days >= TEMPORARY_EXPIRED_DAYS,
+            waiting_days >= TEMPORARY_CRITICAL_DAYS,
+            waiting_days >= TEMPORARY_WARNING_DAYS,
+        ],
+        ['no-date', 'completed-invalid', 'completed', 'expired', 'critical', 'warning'],
+        default='normal'
+    )
+    processing_days = np.select(
+        [~has_request, has_return], [0, completed_days], default=waiting_days
+    )
+
+    waiting = has_request & ~has_return
+    nat = np.datetime64('NaT', 'us')
+    boundaries = [
+        verification_date + np.timedelta64(VERIFICATION_DAYS + 1, 'D'),
+        validity_end,
+        validity_end + AFTER,
+    ] + [
+        np.where(waiting, request_date + np.timedelta64(days, 'D'), nat)
+        for days in (TEMPORARY_WARNING_DAYS, TEMPORARY_CRITICAL_DAYS, TEMPORARY_EXPIRED_DAYS)
+    ]
+
+    return {
+        'status': status,
+        'processing_state': processing_state,
+        'processing_days': processing_days,
+        'next_status_change_at': _next_boundary(now, boundaries),
+    }
+
+
+def _lists(columns):
+    """Arrays to plain Python lists, ready to be indexed per badge"""
+    return {name: column.tolist() for name, column in columns.items()}
+
+
+def classify_permanent(badges, now):
+    durations = np.array([validity_days(badge.get('validity_duration')) for badge in badges], dtype='int64')
+    has_return = np.array([bool(badge.get('gr_return_date')) for badge in badges], dtype=bool)
+    return _lists(classify_permanent_columns(
+        date_column(badges, 'request_date'),
+        date_column(badges, 'gr_return_date'),
+        has_return,
+        date_column(badges, 'effective_validity_end'),
+        durations,
+        now
+    ))
+
+
+def classify_temporary(badges, now):
+    return _lists(classify_temporary_columns(
+        date_column(badges, 'request_date'),
+        date_column(badges, 'gr_return_date'),
+        date_column(badges, 'verification_date'),
+        date_column(badges, 'validity_end'),
+        now
+    ))
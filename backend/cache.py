@@ -0,0 +1,176 @@
+"""In-process cache for computed API payloads.
+
+Entries are stamped with the cache version at the time they were computed;
+``invalidate`` bumps the version so every write makes older entries stale,
+and ``ttl`` bounds how long a date-dependent payload can be served. Callers
+asking for a key that is already being computed wait for that computation
+instead of starting their own.
+
+``ChangeVersions`` keeps a write counter per collection in Mongo, shared by
+every process serving the app, for conditional GETs and cache keys.
+``ReplicaVersion`` tracks which of those versions an in-process copy of the
+data reflects.
+"""
+import threading
+import time
+
+from pymongo import ReturnDocument
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] == self.version and time.monotonic() - entry[2] < self.ttl:
+                self.hits += 1
+                return entry[0]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                version = self.version
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                # A write during the computation leaves the result uncached
+                if flight.error is None and version == self.version:
+                    now = time.monotonic()
+                    # Keys that embed a data version are never asked for again once
+                    # it moves on, so expired entries are dropped here
+                    self._entries = {
+                        other: entry for other, entry in self._entries.items() if now - entry[2] < self.ttl
+                    }
+                    self._entries[key] = (flight.value, version, now)
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'version': self.version,
+                'entries': len(self._entries),
+                'ttl_seconds': self.ttl
+            }
+
+
+class ChangeVersions:
+    """Per-collection write counters, stored in one document of ``collection``.
+
+    Every process bumps and reads the same counters, so an ETag issued by one
+    worker is checked against writes made through any other, and survives
+    restarts. Reading a stamp costs one lookup by ``_id``.
+    """
+
+    def __init__(self, collection, doc_id='data_versions'):
+        self.collection = collection
+        self.doc_id = doc_id
+
+    def bump(self, *names):
+        """Increment ``names``; returns their new versions"""
+        if not names:
+            return {}
+        doc = self.collection.find_one_and_update(
+            {'_id': self.doc_id},
+            {'$inc': {name: 1 for name in names}},
+            projection={name: 1 for name in names},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return {name: doc.get(name, 0) for name in names}
+
+    def versions(self, *names):
+        doc = self.collection.find_one({'_id': self.doc_id}, {name: 1 for name in names}) or {}
+        return {name: doc.get(name, 0) for name in names}
+
+    def stamp(self, *names):
+        versions = self.versions(*names)
+        return '.'.join(str(versions[name]) for name in names)
+
+
+class ReplicaVersion:
+    """The shared version an in-process copy of some data reflects.
+
+    The copy is rebuilt through ``rebuild``. Writes this process applies to
+    the copy itself take a ticket from ``begin`` first and hand it to
+    ``confirm`` with the version their bump returned. The copy only moves to
+    that version when no other bump came in between and no rebuild ran in the
+    meantime, since a rebuild may have dropped the update. Otherwise it stays
+    behind and ``is_behind`` tells the caller to rebuild.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._generation = 0
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            return None if self._rebuilding else self._generation
+
+    def confirm(self, ticket, version):
+        with self._lock:
+            if (ticket is not None and ticket == self._generation and not self._rebuilding
+                    and self.version is not None and version == self.version + 1):
+                self.version = version
+
+    def is_behind(self, version):
+        with self._lock:
+            return self.version is None or version > self.version
+
+    def rebuild(self, current, build):
+        """Rebuild with ``build()``, as of ``current()`` read just before"""
+        with self._lock:
+            self._rebuilding = True
+            self._generation += 1
+        built = None
+        try:
+            version = current()
+            build()
+            built = version
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                if built is not None:
+                    self.version = built
@@ -0,0 +1,108 @@
+"""Content-Encoding negotiation for API responses.
+
+JSON bodies above ``min_size`` bytes are compressed with Brotli when the
+client accepts it and the ``brotli`` package is installed, otherwise with
+gzip. Streamed responses (the NDJSON export) are compressed chunk by chunk
+and flushed after every chunk, so lines still reach the client as they are
+produced. Routes opt out or change the threshold with ``compress_options``;
+file downloads, which are sent as passthrough responses, are never touched.
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/csv'}
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def compress_options(enabled=True, min_size=None):
+    """Per-route settings, read back by ``compress_response``.
+
+    Goes directly under ``@app.route`` so it marks the registered view.
+    """
+    def decorator(func):
+        func.compress_options = {'enabled': enabled, 'min_size': min_size}
+        return func
+    return decorator
+
+
+def available_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+class _GzipStream:
+    def __init__(self):
+        # wbits=31 writes the gzip header and trailer around the deflate stream
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliStream:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, chunk):
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def _compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+
+def _compress_stream(chunks, encoding):
+    stream = _BrotliStream() if encoding == 'br' else _GzipStream()
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if chunk:
+            yield stream.compress(chunk)
+    yield stream.finish()
+
+
+def compress_response(response, request, view, min_size):
+    """Compress ``response`` in place when the client and the route allow it"""
+    options = getattr(view, 'compress_options', {})
+    if not options.get('enabled', True):
+        return response
+    if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < (options.get('min_size') or min_size):
+            return response
+        response.set_data(_compress_body(data, encoding))
+
+    response.headers['Content-Encoding'] = encoding
+    # The body differs per encoding, so only a weak validator still holds
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,132 @@
+"""Canonical date storage for badge documents.
+
+Every badge date is stored as a BSON date (a naive UTC ``datetime`` on the
+Python side). Write routes run ``normalize_dates`` on the request payload and
+``migrate_dates`` converts documents written before that, so read paths and
+Mongo range queries never have to deal with ISO strings.
+"""
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+
+DATE_FIELDS = {
+    'permanent': [
+        'request_date', 'validity_end', 'verification_date', 'dgsn_sent_date',
+        'dgsn_return_date', 'gr_sent_date', 'gr_return_date', 'dgsn_sent',
+        'effective_validity_end'
+    ],
+    'temporary': [
+        'request_date', 'validity_start', 'validity_end', 'verification_date',
+        'dgsn_sent_date', 'dgsn_return_date', 'gr_sent_date', 'gr_return_date',
+        'dgsn_sent', 'expiry_acknowledged'
+    ],
+    'recovered': [
+        'recovery_date', 'request_date', 'validity_start', 'validity_end', 'created_at'
+    ],
+}
+
+MIGRATION_ID = 'canonical-dates'
+
+
+def parse_date(value):
+    """Return a naive UTC datetime for a datetime or ISO string, else None"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def as_date(value):
+    """Stored dates are canonical, anything that is not a datetime is missing"""
+    return value if isinstance(value, datetime) else None
+
+
+def normalize_dates(badge_type, data):
+    """Convert the date fields of a request payload in place.
+
+    Empty strings become None; a string that is not an ISO date raises
+    ValueError so the route can answer 400.
+    """
+    for field in DATE_FIELDS[badge_type]:
+        value = data.get(field)
+        if isinstance(value, str):
+            if not value.strip():
+                data[field] = None
+                continue
+            parsed = parse_date(value)
+            if parsed is None:
+                raise ValueError(f'Invalid date for {field}: {value}')
+            data[field] = parsed
+        elif isinstance(value, datetime):
+            data[field] = parse_date(value)
+    return data
+
+
+def _migrate_collection(collection, fields, migrations, batch_size, log):
+    progress_id = f'{MIGRATION_ID}:{collection.name}'
+    progress = migrations.find_one({'_id': progress_id}) or {}
+    if progress.get('completed'):
+        return
+
+    last_id = progress.get('last_id')
+    converted = progress.get('converted', 0)
+    skipped = progress.get('skipped', 0)
+    has_string = {'$or': [{field: {'$type': 'string'}} for field in fields]}
+
+    while True:
+        query = has_string if last_id is None else {'$and': [has_string, {'_id': {'$gt': last_id}}]}
+        batch = list(collection.find(query, {field: 1 for field in fields}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            original, changes = {}, {}
+            for field in fields:
+                value = doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                parsed = None if not value.strip() else parse_date(value)
+                if parsed is None and value.strip():
+                    skipped += 1
+                    continue
+                original[field] = value
+                changes[field] = parsed
+            if changes:
+                # Match on the old values so a concurrent edit is never overwritten
+                operations.append(UpdateOne({'_id': doc['_id'], **original}, {'$set': changes}))
+        if operations:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+
+        last_id = batch[-1]['_id']
+        migrations.update_one(
+            {'_id': progress_id},
+            {'$set': {'last_id': last_id, 'converted': converted, 'skipped': skipped, 'updated_at': datetime.now()}},
+            upsert=True
+        )
+        log(f'{collection.name}: {converted} documents converted, {skipped} unparseable values kept')
+
+    migrations.update_one(
+        {'_id': progress_id},
+        {'$set': {'completed': True, 'converted': converted, 'skipped': skipped, 'updated_at': datetime.now()}},
+        upsert=True
+    )
+
+
+def migrate_dates(collections, migrations, batch_size=500, restart=False, log=print):
+    """Convert string dates to BSON dates; ``collections`` maps badge type to collection.
+
+    Progress is saved after every batch, so an interrupted run resumes where
+    it stopped. ``restart`` forgets the saved progress and scans again.
+    """
+    for badge_type, collection in collections.items():
+        if restart:
+            migrations.delete_one({'_id': f'{MIGRATION_ID}:{collection.name}'})
+        _migrate_collection(collection, DATE_FIELDS[badge_type], migrations, batch_size, log)
@@ -0,0 +1,201 @@
+"""Query-string filters and sorts for the badge list endpoints.
+
+``?company=&status=&from=&to=&sort=&order=`` (and ``type=`` on the unified
+listing) are translated into Mongo filters on stored fields, each backed by
+one of the indexes created by ``ensure_list_indexes``. ``processing_state=``
+and ``validity_state=`` match the statuses stored by ``badge_status``.
+
+``status=`` is the unified status of the admin badge list. ``unified_status``
+computes it for one badge and ``status_filter`` selects it in Mongo; both
+follow the frontend's ``determineUnifiedStatus`` and must change together.
+"""
+from datetime import datetime, time, timedelta
+
+from badge_status import PROCESSING_STATES, VALIDITY_STATES
+from dates import as_date, parse_date
+
+
+BADGE_TYPES = ('permanent', 'temporary', 'recovered')
+
+# Date each listing is ranged and sorted on
+LIST_DATE_FIELDS = {
+    'permanent': 'request_date',
+    'temporary': 'request_date',
+    'recovered': 'recovery_date',
+}
+
+SORT_KEYS = ('date', 'badge_num', 'full_name', 'company')
+
+STATUSES = ('active', 'expired', 'processing', 'warning', 'delayed', 'recovered')
+
+# Days since the request from which a badge still in processing is also
+# listed under warning, then delayed (warning stops where delayed starts)
+WARNING_DAYS = 6
+DELAYED_DAYS = 10
+PROCESSING_DELAYS = {'warning': (WARNING_DAYS, DELAYED_DAYS), 'delayed': (DELAYED_DAYS, None)}
+
+# Stored dates are canonical, anything else counts as missing (as_date)
+NOT_A_DATE = {'$not': {'$type': 'date'}}
+
+# Matches nothing, for a status that does not apply to a badge type
+NO_MATCH = {'_id': {'$exists': False}}
+
+
+def ensure_list_indexes(collections):
+    for badge_type, collection in collections.items():
+        date_field = LIST_DATE_FIELDS[badge_type]
+        collection.create_index([('badge_num', 1)])
+        collection.create_index([('company', 1), (date_field, 1), ('_id', 1)])
+        collection.create_index([('full_name', 1), ('_id', 1)])
+        collection.create_index([(date_field, 1), ('_id', 1)])
+    collections['recovered'].create_index([('recovery_type', 1), ('recovery_date', 1)])
+    collections['temporary'].create_index([('gr_return_date', 1), ('validity_end', 1)])
+
+
+def start_of_day(moment):
+    return datetime.combine(moment.date(), time())
+
+
+def _end_field(badge_type):
+    # Permanent badges end one duration after the GR return, stored on write
+    return 'effective_validity_end' if badge_type == 'permanent' else 'validity_end'
+
+
+def unified_status(badge_type, badge, today):
+    """(status, delay) of a badge on the admin badge list.
+
+    ``status`` is recovered, processing, active or expired; ``delay`` is
+    warning or delayed for a badge in processing long enough, else None.
+    Validity is compared by calendar day.
+    """
+    if badge_type == 'recovered':
+        return 'recovered', None
+
+    today = start_of_day(today)
+    if badge_type == 'permanent':
+        completed = as_date(badge.get('effective_validity_end')) is not None
+    else:
+        completed = as_date(badge.get('gr_return_date')) is not None
+
+    if completed:
+        # A returned temporary badge without an end date counts as active
+        end = as_date(badge.get(_end_field(badge_type)))
+        return ('expired' if end and end < today else 'active'), None
+
+    request_date = as_date(badge.get('request_date'))
+    if not request_date:
+        return 'processing', None
+    days = (today - start_of_day(request_date)).days
+    for delay, (first_day, last_day) in PROCESSING_DELAYS.items():
+        if days >= first_day and (last_day is None or days < last_day):
+            return 'processing', delay
+    return 'processing', None
+
+
+def _requested_before(days, today):
+    """Request dates before this bound are at least ``days`` calendar days old"""
+    return start_of_day(today) - timedelta(days=days - 1)
+
+
+def status_filter(badge_type, status, today):
+    """Mongo filter selecting the badges ``unified_status`` puts under ``status``"""
+    if badge_type == 'recovered':
+        return {} if status == 'recovered' else NO_MATCH
+    if status == 'recovered':
+        return NO_MATCH
+
+    day = start_of_day(today)
+    end_field = _end_field(badge_type)
+    if badge_type == 'permanent':
+        processing = {end_field: NOT_A_DATE}
+        completed = {}
+    else:
+        processing = {'gr_return_date': NOT_A_DATE}
+        completed = {'gr_return_date': {'$type': 'date'}}
+
+    if status == 'active':
+        if badge_type == 'permanent':
+            return {end_field: {'$gte': day}}
+        return {**completed, '$or': [{end_field: {'$gte': day}}, {end_field: NOT_A_DATE}]}
+    if status == 'expired':
+        return {**completed, end_field: {'$lt': day}}
+    if status in PROCESSING_DELAYS:
+        first_day, last_day = PROCESSING_DELAYS[status]
+        requested = {'$lt': _requested_before(first_day, today)}
+        if last_day is not None:
+            requested['$gte'] = _requested_before(last_day, today)
+        return {**processing, 'request_date': requested}
+    return processing
+
+
+def list_query(badge_type, args, today):
+    """Mongo filter for one collection from the request arguments.
+
+    Raises ValueError for values the endpoint cannot honour.
+    """
+    query = {}
+
+    company = args.get('company')
+    if company:
+        query['company'] = company
+
+    date_field = LIST_DATE_FIELDS[badge_type]
+    date_range = {}
+    for arg, op in (('from', '$gte'), ('to', '$lt')):
+        if args.get(arg):
+            value = parse_date(args[arg])
+            if value is None:
+                raise ValueError(f'Invalid {arg} date')
+            date_range[op] = value
+    if date_range:
+        query[date_field] = date_range
+
+    # Stored statuses; a state the badge type never has matches nothing
+    no_match = False
+    all_processing_states = {state for states in PROCESSING_STATES.values() for state in states}
+    for arg, known, states in (
+        ('processing_state', all_processing_states, PROCESSING_STATES.get(badge_type, ())),
+        ('validity_state', VALIDITY_STATES, VALIDITY_STATES if badge_type == 'permanent' else ()),
+    ):
+        value = args.get(arg)
+        if value:
+            if value not in known:
+                raise ValueError(f"{arg} must be one of {', '.join(sorted(known))}")
+            if value not in states:
+                no_match = True
+            query[arg] = value
+
+    status = args.get('status')
+    if status and status != 'all':
+        if status not in STATUSES:
+            raise ValueError(f"status must be one of {', '.join(STATUSES)}")
+        condition = status_filter(badge_type, status, today)
+        # Both may constrain request_date, so combine instead of merging keys
+        query = {'$and': [query, condition]} if query and condition else (query or condition)
+
+    return NO_MATCH if no_match else query
+
+
+def list_types(args):
+    """Badge types requested with ?type= on the unified listing"""
+    requested = args.get('type')
+    if not requested or requested == 'all':
+        return list(BADGE_TYPES)
+    types = [value for value in requested.split(',') if value]
+    if not types or any(value not in BADGE_TYPES for value in types):
+        raise ValueError(f"type must be one of {', '.join(BADGE_TYPES)}")
+    return types
+
+
+def list_sort(badge_type, args):
+    """(field, direction) for one collection; ``_id`` keeps insertion order"""
+    key = args.get('sort')
+    order = args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    direction = 1 if order == 'asc' else -1
+    if not key:
+        return '_id', direction
+    if key not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    return (LIST_DATE_FIELDS[badge_type] if key == 'date' else key), direction
@@ -0,0 +1,34 @@
+"""orjson-backed JSON provider for the Flask app.
+
+Badge documents are handed to ``jsonify`` straight from Mongo: datetimes and
+dates are written as ISO 8601 strings and ObjectIds as their hex string, so
+routes no longer convert fields one by one. Response bodies are encoded
+directly to bytes without an intermediate ``str``.
+"""
+import orjson
+from bson import ObjectId
+from flask.json.provider import JSONProvider
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class OrjsonProvider(JSONProvider):
+    # orjson writes naive datetimes without an offset, like datetime.isoformat()
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        # Always compact: the NDJSON export writes one document per line
+        return orjson.dumps(obj, default=_default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.option | (orjson.OPT_INDENT_2 if self._app.debug else 0)
+        body = orjson.dumps(obj, default=_default, option=option)
+        return self._app.response_class(body, mimetype='application/json')
@@ -0,0 +1,570 @@
+"""Materialized admin notifications.
+
+The ``notifications`` collection holds one document per event: a permanent
+or temporary badge not sent to the DGSN after 6 (then 10) days, a temporary
+badge expiring within 30 days, or a badge added in the last 24 hours. Ids
+are stable (``perm_<num>``, ``temp_<num>``, ``exp_<num>``, ``new_<num>``):
+an escalation updates the document in place and its resolution
+(``resolved_at``/``resolved_by``) survives every refresh.
+
+``NotificationStore.sync`` regenerates the events of some badges (or of all
+of them) and writes only the documents that differ. It runs for the badges
+a request wrote, and in full on a timer since the thresholds move with the
+clock; reading notifications is then a single indexed query, and reading
+what changed since a client's token a range scan of the change sequence.
+
+Each document records its last change ("new", "escalated", "updated",
+"resolved"). Every process follows the sequence with ``NotificationStore.log``,
+whichever process wrote, and publishes what it reads to its
+``NotificationFeed``, which numbers the changes and fans them out to the open
+event streams of the process.
+"""
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+
+DELAY_WARNING_DAYS = 6
+DELAY_CRITICAL_DAYS = 10
+EXPIRY_NOTICE_DAYS = 30
+NEW_BADGE_HOURS = 24
+
+SEVERITY_RANK = {'critique': 3, 'attention': 2, 'info': 1}
+
+# Fields only the server uses, left out of API responses
+INTERNAL_PROJECTION = {
+    'severity_rank': 0, 'resolved_at': 0, 'resolved_by': 0, 'created_at': 0, 'deleted_at': 0, 'seq': 0,
+    'change': 0
+}
+
+# Badges not sent to the DGSN yet, the only ones that can be delayed. An
+# equality on null, unlike $exists: false, can restrict a partial index.
+UNSENT = {'dgsn_sent': None}
+
+# Counter document holding the change sequence
+SEQUENCE_ID = 'notifications'
+# How long a writer may hold the sequence; a crashed one is taken over after that
+WRITE_LEASE = timedelta(seconds=30)
+LEASE_RETRY_SECONDS = 0.01
+
+# Expires the badge_additions event log
+ADDITIONS_TTL_INDEX = 'added_at_ttl'
+
+
+def public_notification(notification):
+    """A stored notification as the API sends it"""
+    return {
+        'id': notification['_id'],
+        **{key: value for key, value in notification.items() if key != '_id' and key not in INTERNAL_PROJECTION}
+    }
+
+
+def _notification(notification_id, severity, **fields):
+    return {'_id': notification_id, 'severity': severity, 'severity_rank': SEVERITY_RANK[severity], **fields}
+
+
+def ensure_delay_indexes(collections):
+    """Request dates of the unsent badges only, for ``_delays``"""
+    for badge_type in ('permanent', 'temporary'):
+        collections[badge_type].create_index(
+            [('request_date', 1), ('badge_num', 1)], name='request_date_unsent', partialFilterExpression=UNSENT
+        )
+
+
+def ensure_addition_indexes(badge_additions, retention_days):
+    """badge_additions is an event log: Mongo drops events older than ``retention_days``.
+
+    The retention never goes below the ``NEW_BADGE_HOURS`` that ``_additions``
+    reads, which ranges on the compound index.
+    """
+    expire = int(max(timedelta(days=retention_days), timedelta(hours=NEW_BADGE_HOURS)).total_seconds())
+    ttl = badge_additions.index_information().get(ADDITIONS_TTL_INDEX)
+    if ttl is None:
+        badge_additions.create_index([('added_at', 1)], name=ADDITIONS_TTL_INDEX, expireAfterSeconds=expire)
+    elif ttl.get('expireAfterSeconds') != expire:
+        # create_index refuses to change the options of an existing index
+        badge_additions.database.command(
+            'collMod', badge_additions.name, index={'name': ADDITIONS_TTL_INDEX, 'expireAfterSeconds': expire}
+        )
+    badge_additions.create_index([('added_at', 1), ('badge_num', 1)])
+
+
+def _delays(collection, badge_type, prefix, scope, now):
+    # days_delayed >= 10 is a request_date at least 10 days ago: one bounded
+    # range of the partial index per severity
+    critical_cutoff = now - timedelta(days=DELAY_CRITICAL_DAYS)
+    ranges = (
+        ('critique', {'$lte': critical_cutoff}),
+        ('attention', {'$gt': critical_cutoff, '$lte': now - timedelta(days=DELAY_WARNING_DAYS)}),
+    )
+    for severity, request_range in ranges:
+        query = {**UNSENT, 'request_date': request_range, **scope}
+        for badge in collection.find(query, {'badge_num': 1, 'full_name': 1, 'company': 1, 'request_date': 1}):
+            yield _delay(badge, badge_type, prefix, severity, now)
+
+
+def _delay(badge, badge_type, prefix, severity, now):
+    days_delayed = (now - badge['request_date']).days
+    if severity == 'critique':
+        limit = f"{DELAY_CRITICAL_DAYS} jours de traitement" if badge_type == 'permanent' else f"{DELAY_CRITICAL_DAYS} jours"
+        message = f"RETARD CRITIQUE: Badge {badge['badge_num']} dépasse {limit} ({days_delayed} jours)"
+    else:
+        message = f"ATTENTION: Badge {badge['badge_num']} approche échéance ({days_delayed} jours)"
+
+    return _notification(
+        f"{prefix}_{badge['badge_num']}", severity,
+        type='retard',
+        badge_num=badge['badge_num'],
+        badge_type=badge_type,
+        message=message,
+        full_name=badge.get('full_name'),
+        company=badge.get('company'),
+        days_delayed=days_delayed,
+        request_date=badge['request_date']
+    ), None
+
+
+def _expiries(temporary_badges, resolved_notifications, scope, now):
+    expiring = list(temporary_badges.find(
+        {'validity_end': {'$gt': now, '$lte': now + timedelta(days=EXPIRY_NOTICE_DAYS)}, **scope},
+        {'badge_num': 1, 'full_name': 1, 'company': 1, 'validity_end': 1, 'expiry_acknowledged': 1}
+    ))
+    # Resolutions recorded before notifications were stored
+    legacy = {
+        resolution['badge_num']: resolution
+        for resolution in resolved_notifications.find(
+            {'notification_type': 'expiry', 'badge_num': {'$in': [badge['badge_num'] for badge in expiring]}},
+            {'_id': 0, 'badge_num': 1, 'resolved_at': 1, 'resolved_by': 1}
+        )
+    }
+
+    for badge in expiring:
+        badge_num = badge['badge_num']
+        days_remaining = (badge['validity_end'] - now).days
+        resolution = legacy.get(badge_num)
+        if resolution is None and badge.get('expiry_acknowledged'):
+            resolution = {'resolved_at': badge['expiry_acknowledged'], 'resolved_by': None}
+
+        yield _notification(
+            f"exp_{badge_num}", 'info',
+            type='expiration',
+            badge_num=badge_num,
+            badge_type='temporary',
+            message=f"Badge {badge_num} expire dans {days_remaining} jours",
+            full_name=badge.get('full_name'),
+            company=badge.get('company'),
+            days_remaining=days_remaining,
+            expiry_date=badge['validity_end']
+        ), resolution
+
+
+def _additions(badge_additions, scope, now):
+    query = {'added_at': {'$gte': now - timedelta(hours=NEW_BADGE_HOURS)}, **scope}
+    for badge in badge_additions.find(query, {'_id': 0}):
+        yield _notification(
+            f"new_{badge['badge_num']}", 'info',
+            type='nouveau',
+            badge_num=badge['badge_num'],
+            badge_type=badge['type'],
+            message=f"Nouveau badge {badge['type']} ajouté: {badge['badge_num']}",
+            full_name=badge.get('full_name', 'Inconnu'),
+            company=badge.get('company', 'Inconnu'),
+            added_by=badge['added_by'],
+            added_at=badge.get('added_at') or 'N/A'
+        ), None
+
+
+def generate_notifications(collections, badge_additions, resolved_notifications, scope, now):
+    """(notification, legacy resolution or None) for every event of the badges matching ``scope``"""
+    yield from _delays(collections['permanent'], 'permanent', 'perm', scope, now)
+    yield from _delays(collections['temporary'], 'temporary', 'temp', scope, now)
+    yield from _expiries(collections['temporary'], resolved_notifications, scope, now)
+    yield from _additions(badge_additions, scope, now)
+
+
+def parse_token(value):
+    """Change sequence a client last saw, from ``?since=``"""
+    try:
+        token = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('since must be a token returned by this API')
+    if token < 0:
+        raise ValueError('since must be a token returned by this API')
+    return token
+
+
+class Acknowledgements:
+    """What one user has acknowledged.
+
+    ``watermark`` is their last "clear all": every notification raised
+    until then is acknowledged. ``overrides`` maps single notifications
+    acknowledged since to when. A notification raised again (an escalation)
+    after its acknowledgement shows up again.
+    """
+
+    def __init__(self, watermark=None, overrides=None):
+        self.watermark = watermark
+        self.overrides = overrides or {}
+
+    def hides(self, notification):
+        raised_at = notification.get('raised_at') or datetime.min
+        acknowledged_at = self.overrides.get(notification['id'])
+        return any(mark is not None and raised_at <= mark for mark in (self.watermark, acknowledged_at))
+
+
+class NotificationStore:
+    """The notifications collection, its change sequence and acknowledgements.
+
+    Every write that changes what clients see takes the next numbers of a
+    counter document and stores them as ``seq``, so the changes after a
+    token are a range scan of the ``seq`` indexes. A notification that no
+    longer holds stays as a tombstone (``deleted_at``) for ``purge`` to drop
+    later. Writers, in this process or another, take turns through a lease
+    on the counter document, and tokens only go up to ``committed``, the
+    last sequence number whose write is done: a token handed out never skips
+    a change still being written.
+
+    Acknowledgements are per user, in ``acks``: one watermark document per
+    user (``notification_id`` None) and one override per notification
+    acknowledged on its own, so clearing everything is a single write.
+    """
+
+    def __init__(self, notifications, counters, acks):
+        self.notifications = notifications
+        self.counters = counters
+        self.acks = acks
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        self.notifications.create_index([('deleted_at', 1), ('resolved_at', 1), ('severity_rank', -1), ('_id', 1)])
+        self.notifications.create_index([('badge_num', 1)])
+        self.notifications.create_index([('seq', 1)])
+        self.acks.create_index([('user', 1), ('notification_id', 1)], unique=True)
+        self.acks.create_index([('user', 1), ('seq', 1)])
+        self.acks.create_index([('seq', 1)])
+
+    def _lease(self):
+        """Wait for the sequence to be free and take it; returns the writer id"""
+        writer = uuid.uuid4().hex
+        while True:
+            now = datetime.now()
+            try:
+                counter = self.counters.find_one_and_update(
+                    {'_id': SEQUENCE_ID, '$or': [{'writer': None}, {'leased_until': {'$lt': now}}]},
+                    {'$set': {'writer': writer, 'leased_until': now + WRITE_LEASE}},
+                    upsert=True, return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # The counter exists and another writer holds it
+                counter = None
+            if counter is not None:
+                return writer
+            time.sleep(LEASE_RETRY_SECONDS)
+
+    def _write(self, collection, sequenced, silent=()):
+        """Apply (filter, update, upsert) writes, stamping each ``sequenced`` one with the next ``seq``"""
+        silent = [UpdateOne(query, update, upsert=upsert) for query, update, upsert in silent]
+        with self._lock:
+            if not sequenced:
+                if silent:
+                    collection.bulk_write(silent, ordered=False)
+                return
+
+            writer = self._lease()
+            last = None
+            try:
+                counter = self.counters.find_one_and_update(
+                    {'_id': SEQUENCE_ID, 'writer': writer}, {'$inc': {'seq': len(sequenced)}},
+                    return_document=ReturnDocument.AFTER
+                )
+                if counter is None:
+                    raise RuntimeError('Notification sequence lease lost')
+                last = counter['seq']
+                first = last - len(sequenced) + 1
+                collection.bulk_write([
+                    UpdateOne(query, {**update, '$set': {**update['$set'], 'seq': first + i}}, upsert=upsert)
+                    for i, (query, update, upsert) in enumerate(sequenced)
+                ] + silent, ordered=False)
+            finally:
+                # Even after a failed write: what was written is complete, and
+                # a writer that overran its lease has been superseded
+                release = {'$set': {'writer': None, 'leased_until': None}}
+                if last is not None:
+                    release['$max'] = {'committed': last}
+                self.counters.update_one({'_id': SEQUENCE_ID, 'writer': writer}, release)
+
+    def _position(self):
+        """(last sequence committed, last sequence purged)"""
+        counter = self.counters.find_one({'_id': SEQUENCE_ID}) or {}
+        return counter.get('committed', 0), counter.get('purged_seq', 0)
+
+    def token(self):
+        """Last sequence committed, where ``log`` can start from"""
+        return self._position()[0]
+
+    def sync(self, collections, badge_additions, resolved_notifications, badge_nums=None, now=None):
+        """Regenerate the notifications of ``badge_nums``, or of every badge.
+
+        Events that no longer hold become tombstones, new ones are inserted
+        and changed ones updated without touching their resolution. Returns
+        the changes to the open notifications as [(kind, payload)];
+        resolved ones change silently.
+        """
+        now = now or datetime.now()
+        scope = {} if badge_nums is None else {'badge_num': {'$in': sorted(badge_nums)}}
+        stored = {
+            doc['_id']: doc
+            for doc in self.notifications.find(scope, {'resolved_by': 0, 'created_at': 0, 'seq': 0, 'change': 0})
+        }
+
+        sequenced, silent, changes = [], [], []
+        generated = set()
+        for notification, resolution in generate_notifications(
+                collections, badge_additions, resolved_notifications, scope, now):
+            notification_id = notification['_id']
+            generated.add(notification_id)
+            current = stored.get(notification_id)
+            if current is None or current.get('deleted_at') is not None:
+                # New, or back after it lapsed: starts over unresolved
+                fresh = {'created_at': now, 'raised_at': now, 'deleted_at': None, 'change': 'new',
+                         **(resolution or {'resolved_at': None, 'resolved_by': None})}
+                sequenced.append(({'_id': notification_id}, {'$set': {**notification, **fresh}}, True))
+                if resolution is None:
+                    changes.append(('new', public_notification({**notification, 'raised_at': now})))
+                continue
+
+            current.pop('deleted_at', None)
+            raised_at = current.pop('raised_at', None)
+            is_open = current.pop('resolved_at', None) is None
+            if current == notification:
+                continue
+            if not is_open:
+                silent.append(({'_id': notification_id}, {'$set': notification}, False))
+                continue
+            if notification['severity_rank'] > current.get('severity_rank', 0):
+                # Raised again, past any acknowledgement of the milder one
+                sequenced.append((
+                    {'_id': notification_id}, {'$set': {**notification, 'raised_at': now, 'change': 'escalated'}}, False
+                ))
+                changes.append(('escalated', public_notification({**notification, 'raised_at': now})))
+            else:
+                sequenced.append(({'_id': notification_id}, {'$set': {**notification, 'change': 'updated'}}, False))
+                changes.append(('updated', public_notification({**notification, 'raised_at': raised_at})))
+
+        for notification_id in stored.keys() - generated:
+            current = stored[notification_id]
+            if current.get('deleted_at') is not None:
+                continue
+            sequenced.append(({'_id': notification_id}, {'$set': {'deleted_at': now, 'change': 'resolved'}}, False))
+            if current.get('resolved_at') is None:
+                changes.append(('resolved', {'id': notification_id}))
+
+        self._write(self.notifications, sequenced, silent)
+        return changes
+
+    def acknowledgements(self, user):
+        acknowledgements = Acknowledgements()
+        for ack in self.acks.find({'user': user}, {'notification_id': 1, 'acknowledged_at': 1}):
+            if ack['notification_id'] is None:
+                acknowledgements.watermark = ack['acknowledged_at']
+            else:
+                acknowledgements.overrides[ack['notification_id']] = ack['acknowledged_at']
+        return acknowledgements
+
+    def acknowledge(self, user, query, now=None):
+        """Acknowledge the open notifications matching ``query`` for ``user``, in one bulk write.
+
+        Returns the notifications acknowledged.
+        """
+        now = now or datetime.now()
+        targets = list(self.notifications.find(
+            {**query, 'resolved_at': None, 'deleted_at': None}, {'type': 1, 'badge_type': 1, 'badge_num': 1}
+        ))
+        self._write(self.acks, [
+            ({'user': user, 'notification_id': target['_id']}, {'$set': {'acknowledged_at': now}}, True)
+            for target in targets
+        ])
+        return targets
+
+    def clear(self, user, now=None):
+        """Acknowledge everything raised so far for ``user``, with a single write"""
+        now = now or datetime.now()
+        self._write(self.acks, [({'user': user, 'notification_id': None}, {'$set': {'acknowledged_at': now}}, True)])
+        return now
+
+    def current(self, user):
+        """Open notifications ``user`` has not acknowledged, critique first, and the token they are current as of"""
+        token, _ = self._position()
+        acknowledgements = self.acknowledgements(user)
+        stored = self.notifications.find({'resolved_at': None, 'deleted_at': None}, INTERNAL_PROJECTION)
+        notifications = [
+            notification
+            for notification in map(public_notification, stored.sort([('severity_rank', -1), ('_id', 1)]))
+            if not acknowledgements.hides(notification)
+        ]
+        return notifications, token
+
+    def changes_since(self, since, user):
+        """(notifications changed, ids resolved, deleted or acknowledged, token) after ``since``.
+
+        None when the token is unknown, older than purged tombstones or than
+        the user's last "clear all", and the client has to start over from
+        ``current``.
+        """
+        token, purged = self._position()
+        if since < purged or since > token:
+            return None
+        # Writes past the token may still be in progress, the next call gets them
+        window = {'$gt': since, '$lte': token}
+        acks = list(self.acks.find({'user': user, 'seq': window}, {'notification_id': 1}))
+        if any(ack['notification_id'] is None for ack in acks):
+            return None
+
+        changed, removed = [], [ack['notification_id'] for ack in acks]
+        changes = list(
+            self.notifications.find({'seq': window}, {'resolved_by': 0, 'created_at': 0}).sort('seq', 1)
+        )
+        acknowledgements = self.acknowledgements(user) if changes else None
+        for notification in changes:
+            is_open = notification.get('resolved_at') is None and notification.get('deleted_at') is None
+            notification = public_notification(notification)
+            if is_open and not acknowledgements.hides(notification):
+                changed.append(notification)
+            else:
+                removed.append(notification['id'])
+        # Acknowledged and then resolved, or acknowledged then raised again: each id once
+        shown = {notification['id'] for notification in changed}
+        removed = [notification_id for notification_id in dict.fromkeys(removed) if notification_id not in shown]
+        return changed, removed, token
+
+    def log(self, since):
+        """Every change committed after ``since``, for the feed of each process.
+
+        Returns ([(kind, payload, user)], token) in sequence order; ``user``
+        is None except for acknowledgements, which only concern their user.
+        """
+        token, _ = self._position()
+        window = {'$gt': since, '$lte': token}
+        entries = []
+        for notification in self.notifications.find({'seq': window}, {'resolved_by': 0, 'created_at': 0}):
+            if notification.get('resolved_at') is None and notification.get('deleted_at') is None:
+                kind = notification.get('change', 'updated')
+                entries.append((notification['seq'], kind, public_notification(notification), None))
+            else:
+                entries.append((notification['seq'], 'resolved', {'id': notification['_id']}, None))
+        for ack in self.acks.find({'seq': window}):
+            if ack['notification_id'] is None:
+                entries.append((ack['seq'], 'cleared', {'at': ack['acknowledged_at']}, ack['user']))
+            else:
+                payload = {'ids': [ack['notification_id']], 'at': ack['acknowledged_at']}
+                entries.append((ack['seq'], 'acknowledged', payload, ack['user']))
+        entries.sort(key=lambda entry: entry[0])
+        return [entry[1:] for entry in entries], token
+
+    def purge(self, before):
+        """Drop the tombstones older than ``before`` and acknowledgements nothing needs any more"""
+        stale = list(self.notifications.find({'deleted_at': {'$lt': before}}, {'seq': 1}))
+        if stale:
+            # Tokens from before the last purged tombstone can no longer be answered
+            self.counters.update_one(
+                {'_id': SEQUENCE_ID}, {'$max': {'purged_seq': max(doc.get('seq', 0) for doc in stale)}}, upsert=True
+            )
+            self.notifications.delete_many(
+                {'_id': {'$in': [doc['_id'] for doc in stale]}, 'deleted_at': {'$lt': before}}
+            )
+            self.acks.delete_many({'notification_id': {'$in': [doc['_id'] for doc in stale]}})
+
+        # Overrides older than their user's watermark are covered by it
+        for watermark in self.acks.find({'notification_id': None}, {'user': 1, 'acknowledged_at': 1}):
+            self.acks.delete_many({
+                'user': watermark['user'],
+                'notification_id': {'$ne': None},
+                'acknowledged_at': {'$lte': watermark['acknowledged_at']}
+            })
+        return len(stale)
+
+
+class PendingBadges:
+    """Badge numbers written since the generator last ran, and a wake-up for it"""
+
+    def __init__(self):
+        self._badge_nums = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def add(self, badge_nums):
+        with self._lock:
+            self._badge_nums.update(badge_nums)
+        self._wake.set()
+
+    def wait(self, timeout=None):
+        """Block until badges are added or ``timeout`` passes; returns and clears them"""
+        self._wake.wait(timeout)
+        with self._lock:
+            self._wake.clear()
+            badge_nums, self._badge_nums = self._badge_nums, set()
+        return badge_nums
+
+
+class NotificationFeed:
+    """Numbered notification changes, shared by every stream of the process.
+
+    Event ids are ``<epoch>:<sequence>``; the epoch is random per process, so
+    a stream resuming with an id from another process or from before a
+    restart starts over from a snapshot. The last ``history`` changes are
+    kept for streams resuming after a dropped connection. Changes published
+    for a ``user`` (their acknowledgements) only concern that user's streams.
+    The changes come from ``NotificationStore.log``, so a stream sees the
+    writes of every process.
+    """
+
+    def __init__(self, history=1000):
+        self.epoch = uuid.uuid4().hex[:12]
+        self._events = deque(maxlen=history)
+        self._sequence = 0
+        self._published = threading.Condition()
+
+    def publish(self, changes):
+        """Number and hand out [(kind, payload, user)]"""
+        if not changes:
+            return
+        with self._published:
+            for kind, payload, user in changes:
+                self._sequence += 1
+                self._events.append((self._sequence, kind, payload, user))
+            self._published.notify_all()
+
+    def position(self):
+        with self._published:
+            return self._sequence
+
+    def event_id(self, sequence):
+        return f'{self.epoch}:{sequence}'
+
+    def parse_event_id(self, event_id):
+        """Sequence of an id issued by this feed, else None"""
+        epoch, _, sequence = (event_id or '').partition(':')
+        if epoch != self.epoch or not sequence.isdigit() or int(sequence) > self.position():
+            return None
+        return int(sequence)
+
+    def _after(self, sequence):
+        if sequence == self._sequence:
+            return []
+        if not self._events or self._events[0][0] > sequence + 1:
+            return None
+        return [event for event in self._events if event[0] > sequence]
+
+    def wait(self, sequence, timeout):
+        """[(sequence, kind, payload, user)] published after ``sequence``, empty on timeout.
+
+        None when some of them already left the history.
+        """
+        with self._published:
+            self._published.wait_for(lambda: self._sequence > sequence, timeout)
+            return self._after(sequence)
@@ -0,0 +1,141 @@
+"""Keyset pagination for the badge list endpoints.
+
+A page is the next ``limit`` documents after the cursor in (sort key, _id)
+order, fetched with a range predicate on an indexed key, so its cost does not
+depend on how deep into the list the client is. The cursor handed to clients
+is an opaque URL-safe token carrying the last key of the previous page.
+"""
+import base64
+import heapq
+
+from bson import json_util
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; ValueError for anything it did not produce"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, dict) or '_id' not in values:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def parse_limit(value):
+    """Page size from the query string; ValueError when out of range"""
+    try:
+        limit = int(value) if value not in (None, '') else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit
+
+
+def keyset_filter(cursor, sort_field='_id', direction=1):
+    """Documents strictly after ``cursor`` in (sort_field, _id) order.
+
+    Mongo sorts null/missing before every value ascending and after every
+    value descending, and range operators never match null, so the null
+    side of the order is spelled out explicitly.
+    """
+    op = '$gt' if direction == 1 else '$lt'
+    if cursor is None:
+        return {}
+    if sort_field == '_id':
+        return {'_id': {op: cursor['_id']}}
+    value = cursor.get('v')
+    same_value = {sort_field: value, '_id': {op: cursor['_id']}}
+    if direction == 1:
+        after_value = {sort_field: {'$ne': None}} if value is None else {sort_field: {'$gt': value}}
+        return {'$or': [after_value, same_value]}
+    if value is None:
+        return same_value
+    return {'$or': [{sort_field: {'$lt': value}}, {sort_field: None}, same_value]}
+
+
+def sort_spec(sort_field='_id', direction=1):
+    if sort_field == '_id':
+        return [('_id', direction)]
+    return [(sort_field, direction), ('_id', direction)]
+
+
+def _and(*queries):
+    queries = [query for query in queries if query]
+    if not queries:
+        return {}
+    return queries[0] if len(queries) == 1 else {'$and': queries}
+
+
+def count(collection, query):
+    """Total matching documents; the unfiltered case reads collection metadata"""
+    if not query:
+        return collection.estimated_document_count()
+    return collection.count_documents(query)
+
+
+def _cursor_for(doc, sort_field):
+    values = {'_id': doc['_id']}
+    if sort_field != '_id':
+        values['v'] = doc.get(sort_field)
+    return encode_cursor(values)
+
+
+def fetch_page(collection, query, projection, limit, after=None, sort_field='_id', direction=1):
+    """Return (documents, next_cursor) for one collection"""
+    cursor = decode_cursor(after) if after else None
+    docs = list(
+        collection.find(_and(query, keyset_filter(cursor, sort_field, direction)), projection)
+        .sort(sort_spec(sort_field, direction))
+        .limit(limit + 1)
+    )
+    next_cursor = _cursor_for(docs[limit - 1], sort_field) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def fetch_merged_page(sources, projection, limit, after=None, direction=1):
+    """Page through several collections as one list.
+
+    ``sources`` is a list of (label, collection, query, sort_field); the sort
+    field may differ per collection (e.g. request_date vs recovery_date) as
+    long as the values compare. The result is a list of (label, document)
+    plus the next cursor. Each collection contributes at most ``limit + 1``
+    documents, so a page is O(limit) whatever the totals.
+    """
+    cursor = decode_cursor(after) if after else None
+    sort_fields = {label: sort_field for label, _, _, sort_field in sources}
+
+    def sort_key(item):
+        label, doc = item
+        sort_field = sort_fields[label]
+        if sort_field == '_id':
+            return (doc['_id'],)
+        # Same order as Mongo: null/missing values before everything else
+        value = doc.get(sort_field)
+        return (value is not None, value, doc['_id'])
+
+    streams = []
+    for label, collection, query, sort_field in sources:
+        docs = (
+            collection.find(_and(query, keyset_filter(cursor, sort_field, direction)), projection)
+            .sort(sort_spec(sort_field, direction))
+            .limit(limit + 1)
+        )
+        streams.append([(label, doc) for doc in docs])
+
+    merged = list(heapq.merge(*streams, key=sort_key, reverse=direction == -1))
+    page = merged[:limit]
+    if len(merged) <= limit:
+        return page, None
+    label, doc = page[-1]
+    return page, _cursor_for(doc, sort_fields[label])
@@ -0,0 +1,76 @@
+"""Index-backed badge search.
+
+Every badge carries ``_search``, a copy of its searchable fields lowercased
+and stripped of accents, plus the individual words of the name and company.
+Write routes refresh it with ``search_fields``. A search term is folded the
+same way, escaped, and matched as an anchored prefix, which Mongo answers
+with a bounded scan of the ``_search.*`` indexes instead of a collection
+scan.
+"""
+import re
+import unicodedata
+
+from pymongo import UpdateOne
+
+
+SEARCH_FIELDS = ('badge_num', 'full_name', 'company', 'cin')
+# Fields whose words are also matched on their own, e.g. a last name
+WORD_FIELDS = ('full_name', 'company')
+
+
+def fold(value):
+    """Lowercase, accent-free, single-spaced form of a value, for matching"""
+    if value is None:
+        return ''
+    text = unicodedata.normalize('NFKD', str(value))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.casefold().split())
+
+
+def search_fields(badge):
+    """``_search`` for a badge document, to store alongside it"""
+    shadow = {field: fold(badge.get(field)) for field in SEARCH_FIELDS}
+    shadow['words'] = sorted({word for field in WORD_FIELDS for word in shadow[field].split()})
+    return {'_search': shadow}
+
+
+def ensure_search_indexes(collections):
+    for collection in collections.values():
+        for field in SEARCH_FIELDS + ('words',):
+            collection.create_index([(f'_search.{field}', 1)])
+
+
+def backfill_search_fields(collections, batch_size=500):
+    """Store ``_search`` on badges written before it existed"""
+    for collection in collections.values():
+        while True:
+            batch = list(collection.find({'_search': {'$exists': False}}, SEARCH_FIELDS).limit(batch_size))
+            if not batch:
+                break
+            collection.bulk_write([
+                UpdateOne({'_id': badge['_id'], '_search': {'$exists': False}}, {'$set': search_fields(badge)})
+                for badge in batch
+            ], ordered=False)
+
+
+def parse_offset(value):
+    """Number of matches to skip, from the query string"""
+    try:
+        offset = int(value) if value not in (None, '') else 0
+    except ValueError:
+        raise ValueError('offset must be an integer')
+    if offset < 0:
+        raise ValueError('offset must not be negative')
+    return offset
+
+
+def search_query(term):
+    """Mongo filter for badges with a field or word starting with ``term``.
+
+    Raises ValueError when nothing is left to match once the term is folded.
+    """
+    folded = fold(term)
+    if not folded:
+        raise ValueError('Query required')
+    prefix = {'$regex': '^' + re.escape(folded)}
+    return {'$or': [{f'_search.{field}': prefix} for field in SEARCH_FIELDS + ('words',)]}
@@ -0,0 +1,369 @@
+"""Server-side statistics for the admin dashboard.
+
+Counters that do not depend on the current date (monthly histograms, totals,
+company set, processing times, data quality) live in the ``badge_stats``
+rollup collection and are maintained with ``$inc`` by the badge write routes.
+Counters that do depend on today (valid, expired, delayed, expiring soon) are
+index range counts on the stored end-of-validity and request dates.
+"""
+from datetime import timedelta
+
+from pymongo import UpdateOne
+
+from dates import as_date
+
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# Permanent badges stay valid this many days after the GR return date
+VALIDITY_DAYS = {'1 year': 365, '3 years': 365 * 3, '5 years': 365 * 5}
+
+DELAY_DAYS = 6
+# Badges still waiting for their GR return; partial indexes can restrict on
+# an equality to null but not on $exists: false
+PENDING_RETURN = {'gr_return_date': None}
+EXPIRY_WINDOW_DAYS = 30
+DEFAULT_PROCESSING_TIME = 7.2
+
+BADGE_TYPES = ('permanent', 'temporary', 'recovered')
+
+# Date used for the monthly/yearly histograms of each badge type
+HISTOGRAM_FIELDS = {
+    'permanent': 'request_date',
+    'temporary': 'request_date',
+    'recovered': 'recovery_date',
+}
+
+ROLLUP_FIELDS = [
+    'badge_num', 'full_name', 'company', 'cin', 'request_date', 'recovery_date',
+    'gr_return_date', 'dgsn_sent', 'validity_end', 'validity_duration'
+]
+
+
+def validity_days(validity_duration):
+    return VALIDITY_DAYS.get(validity_duration, VALIDITY_DAYS['1 year'])
+
+
+# Rollup maintenance
+
+def _is_complete(badge_type, request_date, gr_return_date, validity_end):
+    if badge_type == 'permanent':
+        return gr_return_date is not None
+    return gr_return_date is not None and validity_end is not None
+
+
+def _rollup_rows(badge_type, badge):
+    """Yield (identity, counters) pairs one badge contributes to the rollup"""
+    company = badge.get('company')
+    totals = {
+        'total': 1,
+        'complete': int(all(badge.get(field) for field in ('badge_num', 'full_name', 'company', 'cin'))),
+        'accurate_dates': int(bool(badge.get('request_date') or badge.get('recovery_date'))),
+        'matched_companies': int(isinstance(company, str) and len(company) > 2),
+        'updated_statuses': int(bool(badge.get('gr_return_date') or badge.get('dgsn_sent'))),
+    }
+
+    if badge_type in ('permanent', 'temporary'):
+        request_date = as_date(badge.get('request_date'))
+        gr_return_date = as_date(badge.get('gr_return_date'))
+        validity_end = as_date(badge.get('validity_end'))
+        totals['completed'] = int(_is_complete(badge_type, request_date, gr_return_date, validity_end))
+        totals['processing_days_sum'] = 0
+        totals['processing_days_count'] = 0
+        if request_date and gr_return_date:
+            days = (gr_return_date - request_date).days
+            if 0 <= days <= 365:
+                totals['processing_days_sum'] = days
+                totals['processing_days_count'] = 1
+
+    yield ('totals', badge_type, None, None, None), totals
+
+    histogram_date = as_date(badge.get(HISTOGRAM_FIELDS[badge_type]))
+    if histogram_date:
+        yield ('month', badge_type, histogram_date.year, histogram_date.month, None), {'count': 1}
+
+    if 'company' in badge and isinstance(company, (str, type(None))):
+        yield ('company', None, None, None, company), {'count': 1}
+
+
+def _identity_filter(identity):
+    kind, badge_type, year, month, company = identity
+    return {'kind': kind, 'badge_type': badge_type, 'year': year, 'month': month, 'company': company}
+
+
+def _accumulate(deltas, badge_type, badge, sign):
+    for identity, counters in _rollup_rows(badge_type, badge):
+        row = deltas.setdefault(identity, {})
+        for key, value in counters.items():
+            row[key] = row.get(key, 0) + sign * value
+
+
+def apply_rollup(badge_stats, badge_type, before=None, after=None):
+    """Move the rollup from the ``before`` badge state to the ``after`` state"""
+    deltas = {}
+    if before:
+        _accumulate(deltas, badge_type, before, -1)
+    if after:
+        _accumulate(deltas, badge_type, after, 1)
+
+    operations = []
+    for identity, counters in deltas.items():
+        counters = {key: value for key, value in counters.items() if value}
+        if counters:
+            operations.append(UpdateOne(_identity_filter(identity), {'$inc': counters}, upsert=True))
+    if operations:
+        badge_stats.bulk_write(operations, ordered=False)
+
+
+def ensure_rollup_indexes(badge_stats):
+    badge_stats.create_index(
+        [('kind', 1), ('badge_type', 1), ('year', 1), ('month', 1), ('company', 1)],
+        unique=True
+    )
+
+
+def rebuild_rollup(badge_stats, collections):
+    """Regenerate the rollup from scratch; ``collections`` maps badge type to collection"""
+    deltas = {}
+    projection = {field: 1 for field in ROLLUP_FIELDS}
+    for badge_type, collection in collections.items():
+        for badge in collection.find({}, projection):
+            _accumulate(deltas, badge_type, badge, 1)
+
+    documents = [{**_identity_filter(identity), **counters} for identity, counters in deltas.items()]
+    if not documents:
+        badge_stats.delete_many({})
+        return 0
+
+    # Build aside and swap in, so readers never see a half-built rollup
+    staging = badge_stats.database[badge_stats.name + '_rebuild']
+    staging.drop()
+    staging.insert_many(documents)
+    ensure_rollup_indexes(staging)
+    staging.rename(badge_stats.name, dropTarget=True)
+    return len(documents)
+
+
+def read_rollup(badge_stats):
+    """Return ({type: by_month}, {type: totals}, company_count) from the rollup"""
+    by_month = {badge_type: [] for badge_type in BADGE_TYPES}
+    totals = {badge_type: {} for badge_type in BADGE_TYPES}
+    for row in badge_stats.find({'kind': {'$in': ['month', 'totals']}}, {'_id': 0}):
+        if row['kind'] == 'totals':
+            totals[row['badge_type']] = row
+        elif row.get('count', 0) > 0:
+            by_month[row['badge_type']].append({
+                '_id': f"{row['year']:04d}-{row['month']:02d}",
+                'count': row['count']
+            })
+    for rows in by_month.values():
+        rows.sort(key=lambda row: row['_id'])
+
+    companies = badge_stats.count_documents({'kind': 'company', 'count': {'$gt': 0}})
+    return by_month, totals, companies
+
+
+# Date-dependent counters
+
+def permanent_validity_end(badge):
+    """End of validity of a permanent badge: GR return date plus its duration"""
+    gr_return_date = as_date(badge.get('gr_return_date'))
+    if not gr_return_date:
+        return None
+    return gr_return_date + timedelta(days=validity_days(badge.get('validity_duration')))
+
+
+def _validity_days_expr(field='validity_duration'):
+    value = '$' + field
+    return {'$switch': {
+        'branches': [
+            {'case': {'$eq': [value, duration]}, 'then': days}
+            for duration, days in VALIDITY_DAYS.items() if duration != '1 year'
+        ],
+        'default': VALIDITY_DAYS['1 year']
+    }}
+
+
+def backfill_validity_end(permanent_badges):
+    """Store effective_validity_end on permanent badges written before it existed"""
+    has_gr = {'$eq': [{'$type': '$gr_return_date'}, 'date']}
+    permanent_badges.update_many(
+        {'effective_validity_end': {'$exists': False}},
+        [{'$set': {'effective_validity_end': {'$cond': [
+            has_gr,
+            {'$add': ['$gr_return_date', {'$multiply': [_validity_days_expr(), DAY_MS]}]},
+            None
+        ]}}}]
+    )
+
+
+def ensure_status_indexes(permanent_badges, temporary_badges):
+    # Completed permanent badges are ranged on their end date, pending ones
+    # (effective_validity_end null) on their request date
+    permanent_badges.create_index([('effective_validity_end', 1), ('request_date', 1)])
+    temporary_badges.create_index([('validity_end', 1)])
+    temporary_badges.create_index([('request_date', 1), ('_id', 1)])
+    # Delayed temporary badges are counted on this index alone
+    temporary_badges.create_index(
+        [('request_date', 1)], name='request_date_pending_return', partialFilterExpression=PENDING_RETURN
+    )
+
+
+def status_counts(collection, badge_type, today):
+    """Valid/expired/delayed/expiring counters for one badge type, as index range counts"""
+    delay_cutoff = today - timedelta(days=DELAY_DAYS)
+    expiry_cutoff = today + timedelta(days=EXPIRY_WINDOW_DAYS)
+
+    if badge_type == 'permanent':
+        end_field = 'effective_validity_end'
+        completed = {}
+        pending = [{'effective_validity_end': None}]
+    else:
+        end_field = 'validity_end'
+        completed = {'gr_return_date': {'$type': 'date'}}
+        # Not returned yet, or returned without an end date; disjoint, each
+        # one a bounded index range
+        pending = [PENDING_RETURN, {'validity_end': None, 'gr_return_date': {'$ne': None}}]
+
+    return {
+        'valid': collection.count_documents({**completed, end_field: {'$gte': today}}),
+        'expired': collection.count_documents({**completed, end_field: {'$lt': today}}),
+        'delayed': sum(
+            collection.count_documents({**query, 'request_date': {'$lte': delay_cutoff}}) for query in pending
+        ),
+        'expiring_soon': collection.count_documents({end_field: {'$gt': today, '$lte': expiry_cutoff}}),
+    }
+
+
+# Time series
+
+TIMESERIES_FIELDS = {
+    'permanent': ['request_date', 'gr_return_date'],
+    'temporary': ['request_date', 'gr_return_date', 'validity_end'],
+    'recovered': ['recovery_date'],
+}
+TIMESERIES_BUCKETS = ('day', 'week', 'month', 'year')
+MAX_TIMESERIES_BUCKETS = 1000
+
+
+def ensure_timeseries_indexes(collections):
+    for badge_type, fields in TIMESERIES_FIELDS.items():
+        for field in fields:
+            keys = [(field, 1)]
+            if field == HISTOGRAM_FIELDS[badge_type]:
+                # Same spec as the list index, which also sorts on _id
+                keys.append(('_id', 1))
+            collections[badge_type].create_index(keys)
+
+
+def bucket_start(value, bucket):
+    """Truncate a datetime the way $dateTrunc does (weeks start on Monday)"""
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == 'week':
+        return value - timedelta(days=value.weekday())
+    if bucket == 'month':
+        return value.replace(day=1)
+    if bucket == 'year':
+        return value.replace(month=1, day=1)
+    return value
+
+
+def next_bucket(value, bucket):
+    if bucket == 'day':
+        return value + timedelta(days=1)
+    if bucket == 'week':
+        return value + timedelta(days=7)
+    if bucket == 'month':
+        return value.replace(year=value.year + value.month // 12, month=value.month % 12 + 1)
+    return value.replace(year=value.year + 1)
+
+
+def timeseries_buckets(start, end, bucket):
+    """Bucket starts covering [start, end); ValueError past MAX_TIMESERIES_BUCKETS"""
+    buckets = []
+    current = bucket_start(start, bucket)
+    while current < end:
+        buckets.append(current)
+        if len(buckets) > MAX_TIMESERIES_BUCKETS:
+            raise ValueError('Too many buckets, narrow the range or use a larger bucket')
+        current = next_bucket(current, bucket)
+    return buckets
+
+
+def compute_timeseries(collection, field, start, end, bucket):
+    """Badge counts per bucket of ``field`` in [start, end), zero-filled"""
+    buckets = timeseries_buckets(start, end, bucket)
+    pipeline = [
+        {'$match': {field: {'$gte': start, '$lt': end}}},
+        {'$group': {
+            '_id': {'$dateTrunc': {'date': '$' + field, 'unit': bucket, 'startOfWeek': 'monday'}},
+            'count': {'$sum': 1}
+        }}
+    ]
+    counts = {row['_id']: row['count'] for row in collection.aggregate(pipeline)}
+    return [{'_id': value.isoformat(), 'count': counts.get(value, 0)} for value in buckets]
+
+
+# /api/stats payload
+
+def years_from_months(by_month):
+    """Fold '%Y-%m' buckets into sorted '%Y' buckets"""
+    years = {}
+    for row in by_month:
+        year = row['_id'][:4]
+        years[year] = years.get(year, 0) + row['count']
+    return [{'_id': year, 'count': count} for year, count in sorted(years.items())]
+
+
+def _percentage(part, total):
+    return round((part / total * 100), 1) if total > 0 else 100
+
+
+def compute_stats(badge_stats, permanent_badges, temporary_badges, today):
+    """Return the (stats, summary) pair served by /api/stats"""
+    by_month, totals, companies = read_rollup(badge_stats)
+    permanent = {**totals['permanent'], **status_counts(permanent_badges, 'permanent', today)}
+    temporary = {**totals['temporary'], **status_counts(temporary_badges, 'temporary', today)}
+    recovered = totals['recovered']
+
+    def total(key, *summaries):
+        return sum(s.get(key, 0) for s in summaries)
+
+    total_all = total('total', permanent, temporary, recovered)
+
+    processing_count = total('processing_days_count', permanent, temporary)
+    avg_processing_time = (
+        round(total('processing_days_sum', permanent, temporary) / processing_count, 1)
+        if processing_count else DEFAULT_PROCESSING_TIME
+    )
+
+    quality = (permanent, temporary, recovered)
+    stats = {
+        'permanent_by_month': by_month['permanent'],
+        'temporary_by_month': by_month['temporary'],
+        'recovered_by_month': by_month['recovered'],
+        'permanent_by_year': years_from_months(by_month['permanent']),
+        'temporary_by_year': years_from_months(by_month['temporary']),
+        'recovered_by_year': years_from_months(by_month['recovered'])
+    }
+    summary = {
+        'total_all': total_all,
+        'total_permanent': permanent.get('total', 0),
+        'total_temporary': temporary.get('total', 0),
+        'total_recovered': recovered.get('total', 0),
+        # Recovered badges have their own category and are never counted as valid
+        'valid_badges': total('valid', permanent, temporary),
+        'expired_badges': total('expired', permanent, temporary),
+        'processing_badges': total('total', permanent, temporary) - total('completed', permanent, temporary),
+        'delayed_badges': total('delayed', permanent, temporary),
+        'expiring_soon': total('expiring_soon', permanent, temporary),
+        'companies': companies,
+        'avg_processing_time': avg_processing_time,
+        'data_quality': {
+            'complete_records': _percentage(total('complete', *quality), total_all),
+            'date_accuracy': _percentage(total('accurate_dates', *quality), total_all),
+            'company_matching': _percentage(total('matched_companies', *quality), total_all),
+            'status_updates': _percentage(total('updated_statuses', *quality), total_all)
+        }
+    }
+    return stats, summary
@@ -0,0 +1,117 @@
+"""Typeahead suggestions for badge numbers, names and companies.
+
+For each suggestible field the distinct values of all badges are kept as a
+sorted list of folded keys (see ``search.fold``), so the completions of a
+prefix are the contiguous slice found with two bisections. Each key counts
+the badges holding it and remembers the spelling most of them use. Prefixes
+shorter than ``SHORT_PREFIX`` match most of the keys, so their best keys are
+ranked once and kept until a write touches one of them. The index is built
+at startup and ``update`` follows every badge write.
+"""
+import heapq
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+
+from search import fold
+
+
+SUGGEST_FIELDS = ('company', 'badge_num', 'full_name')
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+SHORT_PREFIX = 2
+
+
+class _FieldIndex:
+    def __init__(self):
+        self.keys = []
+        self.spellings = {}
+        self.counts = {}
+        # Short prefix -> its MAX_SUGGESTIONS best keys, best first
+        self._top = {}
+
+    def _touch(self, key):
+        for length in range(SHORT_PREFIX):
+            self._top.pop(key[:length], None)
+
+    def add(self, value):
+        key = fold(value)
+        if not key:
+            return
+        spellings = self.spellings.get(key)
+        if spellings is None:
+            spellings = self.spellings[key] = Counter()
+            insort(self.keys, key)
+        spellings[str(value).strip()] += 1
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self._touch(key)
+
+    def remove(self, value):
+        key = fold(value)
+        spellings = self.spellings.get(key)
+        if spellings is None:
+            return
+        spelling = str(value).strip()
+        spellings[spelling] -= 1
+        if spellings[spelling] <= 0:
+            del spellings[spelling]
+        self.counts[key] -= 1
+        if not spellings:
+            del self.spellings[key]
+            del self.counts[key]
+            del self.keys[bisect_left(self.keys, key)]
+        self._touch(key)
+
+    def _best(self, prefix, limit):
+        start = bisect_left(self.keys, prefix)
+        # Every key starting with prefix sorts before prefix + the highest code point
+        end = bisect_right(self.keys, prefix + '\U0010ffff', lo=start)
+        return heapq.nlargest(limit, self.keys[start:end], key=lambda key: (self.counts[key], -len(key)))
+
+    def complete(self, prefix, limit):
+        if len(prefix) < SHORT_PREFIX:
+            top = self._top.get(prefix)
+            if top is None:
+                top = self._top[prefix] = self._best(prefix, MAX_SUGGESTIONS)
+            best = top[:limit]
+        else:
+            best = self._best(prefix, limit)
+        return [
+            {'value': self.spellings[key].most_common(1)[0][0], 'count': self.counts[key]}
+            for key in best
+        ]
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._fields = {field: _FieldIndex() for field in SUGGEST_FIELDS}
+        self._lock = threading.Lock()
+
+    def build(self, collections):
+        fields = {field: _FieldIndex() for field in SUGGEST_FIELDS}
+        for collection in collections.values():
+            for badge in collection.find({}, {field: 1 for field in SUGGEST_FIELDS}):
+                for field, index in fields.items():
+                    index.add(badge.get(field))
+        with self._lock:
+            self._fields = fields
+
+    def update(self, before=None, after=None):
+        """Follow a create (after only), update (both) or delete (before only)"""
+        with self._lock:
+            for field, index in self._fields.items():
+                if before is not None:
+                    index.remove(before.get(field))
+                if after is not None:
+                    index.add(after.get(field))
+
+    def suggest(self, field, prefix, limit=DEFAULT_SUGGESTIONS):
+        """Most used values of ``field`` starting with ``prefix``, with their counts"""
+        with self._lock:
+            return self._fields[field].complete(fold(prefix), limit)
+
+    def exists(self, field, value):
+        """Whether some badge already has exactly this value, e.g. a badge number before submit"""
+        with self._lock:
+            spellings = self._fields[field].spellings.get(fold(value))
+            return spellings is not None and str(value).strip() in spellings
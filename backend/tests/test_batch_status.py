@@ -0,0 +1,132 @@
+"""The status rules of batch_status, as stored by badge_status and counted by the read paths"""
+from datetime import datetime, timedelta
+from itertools import product
+
+import pytest
+
+from badge_status import CLASSIFIERS, batch_status_fields, processing_days, validity_status_days
+from batch_status import classify_permanent, classify_temporary
+from dates import as_date
+from stats import permanent_validity_end
+
+
+NOW = datetime(2026, 10, 17, 12, 30)
+US = timedelta(microseconds=1)
+
+
+def around(moment):
+    return [moment - US, moment, moment + US]
+
+
+# Missing, empty and non-date values, then dates on and around every boundary
+MISSING = [None, '', 'pas une date', 42]
+REQUEST_DATES = MISSING + [
+    date for days in (0, 5, 6, 9, 10, 11, 400) for date in around(NOW - timedelta(days=days))
+]
+RETURN_OFFSETS = [0, 10, 11]
+END_DATES = MISSING + around(NOW) + [NOW - timedelta(days=3, hours=1), NOW + timedelta(days=3, hours=1)]
+
+
+def permanent_rows():
+    for request_date, gr_return_date, effective_end, duration in product(
+        REQUEST_DATES,
+        MISSING + around(NOW - timedelta(days=365)) + [NOW - timedelta(days=2)],
+        [None, 'pas une date'] + around(NOW),
+        [None, '1 year', '3 years', 'inconnu'],
+    ):
+        yield {
+            'request_date': request_date,
+            'gr_return_date': gr_return_date,
+            'effective_validity_end': effective_end,
+            'validity_duration': duration,
+        }
+
+
+def temporary_rows():
+    for request_date, offset, verification_date, validity_end in product(
+        REQUEST_DATES, [None, 'pas une date'] + RETURN_OFFSETS,
+        MISSING + around(NOW - timedelta(days=10)) + around(NOW - timedelta(days=11)),
+        END_DATES,
+    ):
+        if isinstance(offset, int) and isinstance(request_date, datetime):
+            gr_return_date = request_date + timedelta(days=offset)
+        else:
+            gr_return_date = offset
+        yield {
+            'request_date': request_date,
+            'gr_return_date': gr_return_date,
+            'verification_date': verification_date,
+            'validity_end': validity_end,
+        }
+
+
+def assert_stable_until_next_change(badge_type, badges):
+    """No stored state moves before the badge's next_status_change_at"""
+    initial = batch_status_fields(badge_type, badges, NOW)
+    boundaries = [fields.pop('next_status_change_at') for fields in initial]
+    assert all(boundary is None or boundary > NOW for boundary in boundaries)
+
+    # Just before every boundary, and every few hours for the next 13 days
+    moments = {boundary - US for boundary in boundaries if boundary}
+    moments.update(NOW + timedelta(hours=hours) for hours in range(0, 24 * 13, 7))
+    for moment in sorted(moments):
+        later = batch_status_fields(badge_type, badges, moment)
+        for badge, boundary, before, after in zip(badges, boundaries, initial, later):
+            after.pop('next_status_change_at')
+            if boundary is None or moment < boundary:
+                assert after == before, (moment, badge)
+
+
+@pytest.mark.parametrize('badge_type, rows', [('permanent', permanent_rows), ('temporary', temporary_rows)])
+def test_states_only_move_at_the_stored_boundary(badge_type, rows):
+    assert_stable_until_next_change(badge_type, list(rows()))
+
+
+def test_stored_fields():
+    assert set(CLASSIFIERS) == {'permanent', 'temporary'}
+    badge = {'request_date': NOW - timedelta(days=7)}
+    assert batch_status_fields('temporary', [badge], NOW) == [{
+        'status': 'Unknown',
+        'processing_state': 'warning',
+        'next_status_change_at': badge['request_date'] + timedelta(days=9),
+    }]
+    returned = {'request_date': NOW - timedelta(days=30), 'gr_return_date': NOW - timedelta(days=20)}
+    assert batch_status_fields('permanent', [returned], NOW) == [{
+        'processing_state': 'completed',
+        'validity_state': 'valid',
+        'next_status_change_at': returned['gr_return_date'] + timedelta(days=365) + US,
+    }]
+
+
+@pytest.mark.parametrize('days, state', [(5, 'normal'), (6, 'warning'), (9, 'critical'), (10, 'expired')])
+def test_temporary_processing_thresholds(days, state):
+    badge = {'request_date': NOW - timedelta(days=days)}
+    assert classify_temporary([badge], NOW)['processing_state'] == [state]
+    late = {'request_date': NOW - timedelta(days=30), 'gr_return_date': NOW - timedelta(days=30 - days - 1)}
+    assert classify_temporary([late], NOW)['processing_state'] == [
+        'completed-invalid' if days + 1 > 10 else 'completed'
+    ]
+
+
+def test_read_path_day_counts_match_the_classifiers():
+    badges = list(permanent_rows())
+    status = classify_permanent(badges, NOW)
+    for i, badge in enumerate(badges):
+        if status['processing_state'][i] != 'no-date':
+            assert processing_days(badge, NOW) == status['processing_days'][i], badge
+        validity_end = as_date(badge['effective_validity_end']) or permanent_validity_end(badge)
+        state = status['validity_state'][i]
+        assert validity_status_days(state, validity_end, NOW) == status['validity_days'][i], badge
+
+    badges = list(temporary_rows())
+    status = classify_temporary(badges, NOW)
+    for i, badge in enumerate(badges):
+        assert processing_days(badge, NOW) == status['processing_days'][i], badge
+
+
+@pytest.mark.parametrize('value', ['pas une date', 42])
+def test_permanent_return_date_that_is_not_a_date_is_unknown(value):
+    badge = {'request_date': NOW - timedelta(days=3), 'gr_return_date': value}
+    status = classify_permanent([badge], NOW)
+    assert status['validity_state'] == ['unknown']
+    assert status['processing_state'] == ['processing']
@@ -0,0 +1,63 @@
+"""Shared write counters and the version of in-process replicas, against mongomock"""
+import pytest
+
+from cache import ChangeVersions, ReplicaVersion
+
+mongomock = pytest.importorskip('mongomock')
+
+
+@pytest.fixture
+def counters():
+    return mongomock.MongoClient().db.counters
+
+
+def test_versions_are_shared_through_mongo(counters):
+    one, other = ChangeVersions(counters), ChangeVersions(counters)
+    before = one.stamp('permanent_badges', 'notifications')
+    assert other.bump('permanent_badges') == {'permanent_badges': 1}
+    assert one.stamp('permanent_badges', 'notifications') != before
+    assert one.versions('permanent_badges', 'notifications') == {'permanent_badges': 1, 'notifications': 0}
+    assert one.bump() == {}
+
+
+def test_replica_follows_its_own_writes_only_when_nothing_came_between():
+    replica = ReplicaVersion()
+    assert replica.is_behind(0)
+    replica.rebuild(lambda: 3, lambda: None)
+    assert not replica.is_behind(3)
+
+    replica.confirm(replica.begin(), 4)
+    assert replica.version == 4
+
+    # Another process bumped first: our write lands on 6, 5 was never applied here
+    replica.confirm(replica.begin(), 6)
+    assert replica.is_behind(6)
+
+
+def test_writes_overlapping_a_rebuild_are_not_confirmed():
+    replica = ReplicaVersion()
+    replica.rebuild(lambda: 1, lambda: None)
+    ticket = replica.begin()
+    replica.rebuild(lambda: 1, lambda: None)
+    replica.confirm(ticket, 2)
+    assert replica.is_behind(2)
+
+    tickets = []
+    replica.rebuild(lambda: 2, lambda: tickets.append(replica.begin()))
+    assert tickets == [None]
+    replica.confirm(tickets[0], 3)
+    assert replica.is_behind(3)
+
+
+def test_failed_rebuild_leaves_the_version():
+    replica = ReplicaVersion()
+    replica.rebuild(lambda: 1, lambda: None)
+
+    def fail():
+        raise RuntimeError('scan failed')
+
+    with pytest.raises(RuntimeError):
+        replica.rebuild(lambda: 5, fail)
+    assert replica.version == 1
+    replica.confirm(replica.begin(), 2)
+    assert replica.version == 2
@@ -0,0 +1,96 @@
+"""?status= filters against the status listed for each badge, on mongomock"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from filters import PROCESSING_DELAYS, STATUSES, list_query, unified_status
+
+mongomock = pytest.importorskip('mongomock')
+
+
+NOW = datetime(2026, 10, 17, 15, 30)
+TODAY = datetime(2026, 10, 17)
+
+# Around each day boundary: the day before, midnight, later the same day, the day after
+EDGES = [TODAY + timedelta(days=days, hours=hours) for days in (-1, 0, 1) for hours in (0, 9)]
+
+
+def requested(days, hours=0):
+    return TODAY - timedelta(days=days) + timedelta(hours=hours)
+
+
+def permanent_badges():
+    badges = [{'request_date': None}, {'request_date': 'not a date'}]
+    for days in range(3, 13):
+        badges += [{'request_date': requested(days)}, {'request_date': requested(days, 23)}]
+    for end in EDGES:
+        badges.append({'request_date': requested(400), 'gr_return_date': requested(20), 'effective_validity_end': end})
+    return badges
+
+
+def temporary_badges():
+    badges = [{'request_date': None}, {'request_date': requested(2), 'gr_return_date': ''}]
+    for days in range(3, 13):
+        badges += [{'request_date': requested(days)}, {'request_date': requested(days, 23), 'gr_return_date': None}]
+    badges.append({'request_date': requested(30), 'gr_return_date': requested(25)})
+    badges.append({'request_date': requested(30), 'gr_return_date': requested(25), 'validity_end': None})
+    for end in EDGES:
+        badges.append({'request_date': requested(30), 'gr_return_date': requested(25), 'validity_end': end})
+        # Not returned yet, whatever its validity says
+        badges.append({'request_date': requested(8), 'validity_end': end})
+    return badges
+
+
+@pytest.fixture
+def collections():
+    db = mongomock.MongoClient().db
+    collections = {
+        'permanent': db.permanent_badges,
+        'temporary': db.temporary_badges,
+        'recovered': db.recovered_badges,
+    }
+    collections['permanent'].insert_many(permanent_badges())
+    collections['temporary'].insert_many(temporary_badges())
+    collections['recovered'].insert_many([{'recovery_date': requested(days)} for days in (0, 12)])
+    return collections
+
+
+def listed(collection, badge_type, status):
+    return list(collection.find(list_query(badge_type, {'status': status}, NOW)))
+
+
+@pytest.mark.parametrize('badge_type', ['permanent', 'temporary', 'recovered'])
+def test_every_badge_listed_for_a_status_carries_it(collections, badge_type):
+    collection = collections[badge_type]
+    for status in STATUSES:
+        for badge in listed(collection, badge_type, status):
+            shown, delay = unified_status(badge_type, badge, NOW)
+            if status in PROCESSING_DELAYS:
+                assert (shown, delay) == ('processing', status), badge
+            else:
+                assert shown == status, badge
+
+
+@pytest.mark.parametrize('badge_type', ['permanent', 'temporary', 'recovered'])
+def test_status_filters_cover_every_badge(collections, badge_type):
+    collection = collections[badge_type]
+    for badge in collection.find():
+        shown, delay = unified_status(badge_type, badge, NOW)
+        for status in STATUSES:
+            ids = {doc['_id'] for doc in listed(collection, badge_type, status)}
+            assert (badge['_id'] in ids) == (status in (shown, delay)), (status, badge)
+
+
+def test_processing_delays_follow_the_admin_list_thresholds():
+    assert unified_status('temporary', {'request_date': requested(5, 23)}, NOW) == ('processing', None)
+    assert unified_status('temporary', {'request_date': requested(6, 23)}, NOW) == ('processing', 'warning')
+    assert unified_status('temporary', {'request_date': requested(9)}, NOW) == ('processing', 'warning')
+    assert unified_status('permanent', {'request_date': requested(10, 23)}, NOW) == ('processing', 'delayed')
+
+
+def test_validity_ends_on_the_calendar_day():
+    returned = {'gr_return_date': requested(25)}
+    assert unified_status('temporary', {**returned, 'validity_end': TODAY}, NOW)[0] == 'active'
+    assert unified_status('temporary', {**returned, 'validity_end': TODAY - timedelta(minutes=1)}, NOW)[0] == 'expired'
+    assert unified_status('temporary', returned, NOW)[0] == 'active'
+    assert unified_status('permanent', {'effective_validity_end': TODAY + timedelta(hours=9)}, NOW)[0] == 'active'
@@ -0,0 +1,221 @@
+"""NotificationStore change sequence, tombstones and acknowledgements, against mongomock"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from notifications import SEQUENCE_ID, NotificationStore
+
+mongomock = pytest.importorskip('mongomock')
+
+
+NOW = datetime(2026, 10, 17, 12, 0)
+
+
+@pytest.fixture(autouse=True)
+def bulk_sort(monkeypatch):
+    # pymongo 4.9+ hands bulk updates a sort option mongomock does not know
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def without_sort(self, *args, sort=None, **kwargs):
+        return add_update(self, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, 'add_update', without_sort)
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def collections(db):
+    return {'permanent': db.permanent_badges, 'temporary': db.temporary_badges}
+
+
+@pytest.fixture
+def store(db):
+    store = NotificationStore(db.notifications, db.counters, db.notification_acks)
+    store.ensure_indexes()
+    return store
+
+
+def sync(store, db, collections, now=NOW, badge_nums=None):
+    return store.sync(collections, db.badge_additions, db.resolved_notifications, badge_nums=badge_nums, now=now)
+
+
+def delayed(collections, badge_num, days):
+    collections['permanent'].insert_one({'badge_num': badge_num, 'request_date': NOW - timedelta(days=days)})
+
+
+def ids(notifications):
+    return [notification['id'] for notification in notifications]
+
+
+def test_sync_is_idempotent_and_escalates_in_place(store, db, collections):
+    delayed(collections, 'P1', 7)
+    assert [kind for kind, _ in sync(store, db, collections)] == ['new']
+    assert sync(store, db, collections) == []
+
+    changes = sync(store, db, collections, now=NOW + timedelta(days=4))
+    assert [(kind, payload['id'], payload['severity']) for kind, payload in changes] == [
+        ('escalated', 'perm_P1', 'critique')
+    ]
+    assert db.notifications.count_documents({}) == 1
+
+
+def test_changes_since_token(store, db, collections):
+    delayed(collections, 'P1', 7)
+    sync(store, db, collections)
+    notifications, token = store.current('alice')
+    assert ids(notifications) == ['perm_P1']
+    assert store.changes_since(token, 'alice') == ([], [], token)
+
+    delayed(collections, 'P2', 11)
+    sync(store, db, collections)
+    collections['permanent'].delete_one({'badge_num': 'P1'})
+    sync(store, db, collections)
+    changed, removed, new_token = store.changes_since(token, 'alice')
+    assert ids(changed) == ['perm_P2']
+    assert removed == ['perm_P1']
+    assert new_token > token
+
+
+def test_tokens_outside_the_sequence_start_over(store, db, collections):
+    delayed(collections, 'P1', 7)
+    sync(store, db, collections)
+    _, token = store.current('alice')
+    assert store.changes_since(token + 1, 'alice') is None
+
+    collections['permanent'].delete_one({'badge_num': 'P1'})
+    sync(store, db, collections)
+    assert store.purge(NOW + timedelta(days=1)) == 1
+    assert store.changes_since(token, 'alice') is None
+    assert store.changes_since(store.current('alice')[1], 'alice') is not None
+
+
+def test_lapsed_notification_comes_back_unresolved(store, db, collections):
+    delayed(collections, 'P1', 7)
+    sync(store, db, collections)
+    collections['permanent'].update_one({'badge_num': 'P1'}, {'$set': {'dgsn_sent': NOW}})
+    assert [kind for kind, _ in sync(store, db, collections)] == ['resolved']
+    collections['permanent'].update_one({'badge_num': 'P1'}, {'$set': {'dgsn_sent': None}})
+    assert [kind for kind, _ in sync(store, db, collections)] == ['new']
+    assert ids(store.current('alice')[0]) == ['perm_P1']
+
+
+def test_acknowledgements_are_per_user(store, db, collections):
+    delayed(collections, 'P1', 7)
+    delayed(collections, 'P2', 8)
+    sync(store, db, collections)
+    _, token = store.current('alice')
+
+    acknowledged = store.acknowledge('alice', {'_id': 'perm_P1'}, NOW + timedelta(minutes=1))
+    assert ids([{'id': doc['_id']} for doc in acknowledged]) == ['perm_P1']
+    assert ids(store.current('alice')[0]) == ['perm_P2']
+    assert ids(store.current('bob')[0]) == ['perm_P1', 'perm_P2']
+    assert store.changes_since(token, 'alice')[:2] == ([], ['perm_P1'])
+    assert store.changes_since(token, 'bob')[:2] == ([], [])
+
+
+def test_clear_all_hides_until_raised_again(store, db, collections):
+    delayed(collections, 'P1', 7)
+    sync(store, db, collections)
+    _, token = store.current('bob')
+
+    store.clear('bob', NOW + timedelta(minutes=1))
+    assert store.current('bob')[0] == []
+    # Clients behind a "clear all" start over from a snapshot
+    assert store.changes_since(token, 'bob') is None
+
+    later = NOW + timedelta(days=4)
+    sync(store, db, collections, now=later)
+    assert ids(store.current('bob')[0]) == ['perm_P1']
+
+
+def test_removed_lists_each_id_once(store, db, collections):
+    delayed(collections, 'P1', 7)
+    delayed(collections, 'P2', 8)
+    sync(store, db, collections)
+    _, token = store.current('alice')
+
+    store.acknowledge('alice', {'_id': 'perm_P2'}, NOW + timedelta(minutes=1))
+    collections['permanent'].delete_one({'badge_num': 'P2'})
+    sync(store, db, collections, now=NOW + timedelta(minutes=2))
+    assert store.changes_since(token, 'alice')[:2] == ([], ['perm_P2'])
+
+
+def test_acknowledged_then_escalated_is_only_changed(store, db, collections):
+    delayed(collections, 'P1', 7)
+    sync(store, db, collections)
+    _, token = store.current('alice')
+
+    store.acknowledge('alice', {'_id': 'perm_P1'}, NOW + timedelta(minutes=1))
+    sync(store, db, collections, now=NOW + timedelta(days=4))
+    changed, removed, _ = store.changes_since(token, 'alice')
+    assert ids(changed) == ['perm_P1']
+    assert removed == []
+
+
+def test_tokens_stop_before_writes_in_progress(store, db, collections, monkeypatch):
+    delayed(collections, 'P1', 7)
+    sync(store, db, collections)
+    _, token = store.current('alice')
+
+    # Another process reading while this one is between allocating its
+    # sequence numbers and writing the documents
+    seen = []
+    bulk_write = db.notifications.bulk_write
+
+    def reading_first(operations, **kwargs):
+        seen.append(store.current('alice')[1])
+        seen.append(store.changes_since(token, 'alice'))
+        return bulk_write(operations, **kwargs)
+
+    monkeypatch.setattr(db.notifications, 'bulk_write', reading_first)
+    delayed(collections, 'P2', 8)
+    sync(store, db, collections)
+
+    assert seen == [token, ([], [], token)]
+    changed, _, new_token = store.changes_since(token, 'alice')
+    assert ids(changed) == ['perm_P2']
+    assert new_token == token + 1
+
+
+def test_expired_lease_is_taken_over(store, db, collections):
+    db.counters.update_one(
+        {'_id': SEQUENCE_ID},
+        {'$set': {'writer': 'crashed', 'leased_until': datetime(2000, 1, 1)}},
+        upsert=True
+    )
+    delayed(collections, 'P1', 7)
+    sync(store, db, collections)
+    counter = db.counters.find_one({'_id': SEQUENCE_ID})
+    assert counter['writer'] is None
+    assert counter['committed'] == counter['seq'] == 1
+
+
+def test_log_replays_the_changes_of_any_writer(store, db, collections):
+    delayed(collections, 'P1', 7)
+    sync(store, db, collections)
+    token = store.token()
+
+    # Written through another store, as another process would
+    other = NotificationStore(db.notifications, db.counters, db.notification_acks)
+    delayed(collections, 'P2', 8)
+    sync(other, db, collections)
+    sync(other, db, collections, now=NOW + timedelta(days=4))
+    other.acknowledge('alice', {'_id': 'perm_P2'}, NOW + timedelta(days=4, minutes=1))
+    other.clear('bob', NOW + timedelta(days=4, minutes=2))
+    collections['permanent'].delete_one({'badge_num': 'P1'})
+    sync(other, db, collections, now=NOW + timedelta(days=4, minutes=3))
+
+    changes, new_token = store.log(token)
+    assert [(kind, payload.get('id', payload.get('ids')), user) for kind, payload, user in changes] == [
+        ('escalated', 'perm_P2', None),
+        ('acknowledged', ['perm_P2'], 'alice'),
+        ('cleared', None, 'bob'),
+        ('resolved', 'perm_P1', None),
+    ]
+    assert all('change' not in payload and 'seq' not in payload for _, payload, _ in changes)
+    assert new_token == store.token()
+    assert store.log(new_token) == ([], new_token)
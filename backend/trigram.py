@@ -0,0 +1,147 @@
+"""In-process trigram index for fuzzy badge search.
+
+Each badge is reduced to the words of its folded badge_num, full_name,
+company and cin (see ``search.fold``); every word contributes its trigrams,
+padded so that word starts weigh more. A query is split the same way and
+badges are ranked by the share of the query's trigrams they contain, which
+tolerates typos, missing accents and transliterations ("dupond" still finds
+"Dupont"). The index is built once at startup and kept current by the write
+routes through ``update``. Postings are compact integer arrays: a removed
+badge is only dropped from the document table and its stale postings are
+skipped, until they outnumber ``COMPACT_RATIO`` of the live ones and the
+postings are rebuilt. With values truncated to ``MAX_VALUE_LENGTH``, memory
+stays proportional to the number of badges.
+"""
+import heapq
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import datetime
+
+from search import SEARCH_FIELDS, fold
+
+
+MAX_VALUE_LENGTH = 64
+MIN_SCORE = 0.3
+COMPACT_RATIO = 0.25
+
+
+def trigrams(text):
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def badge_text(badge):
+    return ' '.join(fold(badge.get(field))[:MAX_VALUE_LENGTH] for field in SEARCH_FIELDS)
+
+
+class TrigramIndex:
+    def __init__(self):
+        self._postings = {}
+        self._docs = {}
+        self._keys = {}
+        self._next_id = 0
+        self._stale = 0
+        self._total = 0
+        self._lock = threading.Lock()
+        self.build_seconds = None
+        self.built_at = None
+
+    def build(self, collections):
+        """(Re)build from ``collections``, which maps badge type to collection"""
+        started = time.perf_counter()
+        with self._lock:
+            self._postings, self._docs, self._keys = {}, {}, {}
+            self._next_id = self._stale = self._total = 0
+            for badge_type, collection in collections.items():
+                for badge in collection.find({}, {field: 1 for field in SEARCH_FIELDS}):
+                    self._add(badge_type, badge)
+        self.build_seconds = round(time.perf_counter() - started, 3)
+        self.built_at = datetime.now()
+
+    def _add(self, badge_type, badge):
+        key = (badge_type, badge.get('badge_num'))
+        if key in self._keys:
+            self._remove(key)
+        text = badge_text(badge)
+        doc_id = self._next_id
+        self._next_id += 1
+        self._keys[key] = doc_id
+        self._docs[doc_id] = (key, text)
+        self._index(doc_id, text)
+
+    def _index(self, doc_id, text):
+        grams = trigrams(text)
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array('I')
+            posting.append(doc_id)
+        self._total += len(grams)
+
+    def _remove(self, key):
+        doc_id = self._keys.pop(key, None)
+        if doc_id is None:
+            return
+        _, text = self._docs.pop(doc_id)
+        self._stale += len(trigrams(text))
+        if self._stale > COMPACT_RATIO * max(self._total - self._stale, 1):
+            self._compact()
+
+    def _compact(self):
+        self._postings = {}
+        self._stale = self._total = 0
+        for doc_id, (_, text) in self._docs.items():
+            self._index(doc_id, text)
+
+    def update(self, badge_type, before=None, after=None):
+        """Follow a create (after only), update (both) or delete (before only)"""
+        with self._lock:
+            if before is not None:
+                self._remove((badge_type, before.get('badge_num')))
+            if after is not None:
+                self._add(badge_type, after)
+
+    def search(self, term, limit=20):
+        """Best matches as [(badge_type, badge_num, score)], best first"""
+        grams = trigrams(fold(term))
+        if not grams:
+            return []
+        with self._lock:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._postings.get(gram, ()))
+            # Postings of removed badges are still there until the next compaction
+            ranked = heapq.nlargest(limit, (
+                (hits / len(grams), -len(self._docs[doc_id][1]), doc_id)
+                for doc_id, hits in shared.items()
+                if hits / len(grams) >= MIN_SCORE and doc_id in self._docs
+            ))
+            return [
+                (*self._docs[doc_id][0], round(score, 3))
+                for score, _, doc_id in ranked
+            ]
+
+    def stats(self):
+        """Size and build figures; bytes are an estimate of the index's own structures"""
+        with self._lock:
+            approximate_bytes = (
+                sys.getsizeof(self._postings) + sys.getsizeof(self._docs) + sys.getsizeof(self._keys)
+                + sum(sys.getsizeof(gram) + posting.buffer_info()[1] * posting.itemsize
+                      for gram, posting in self._postings.items())
+                + sum(sys.getsizeof(entry) + sys.getsizeof(entry[1]) for entry in self._docs.values())
+            )
+            return {
+                'documents': len(self._docs),
+                'trigrams': len(self._postings),
+                'postings': self._total - self._stale,
+                'stale_postings': self._stale,
+                'approximate_bytes': approximate_bytes,
+                'build_seconds': self.build_seconds,
+                'built_at': self.built_at,
+            }
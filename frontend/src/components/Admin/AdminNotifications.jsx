@@ -1,37 +1,17 @@
-import React, { useState, useEffect } from 'react';
+import React from 'react';
 import axios from 'axios';
 import { Bell, Clock, PlusCircle, RefreshCw, CheckCircle, AlertTriangle, Trash2, X } from 'react-feather';
 import { useAuth } from '../../context/AuthContext';
+import { useNotifications } from '../../context/NotificationContext';
 
 export default function AdminNotifications() {
   const { user } = useAuth();
-  const [notifications, setNotifications] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [lastUpdated, setLastUpdated] = useState(null);
 
   // Check if user is admin
   const isAdmin = user?.role === 'admin';
-
-  const fetchNotifications = async () => {
-    if (!isAdmin) return;
-
-    try {
-      setLoading(true);
-      const response = await axios.get('http://localhost:5454/api/notifications', { 
-        withCredentials: true 
-      });
-
-      if (response.data.success) {
-        setNotifications(response.data.notifications || []);
-        setLastUpdated(response.data.last_updated);
-      }
-    } catch (err) {
-      console.error('Échec de chargement des notifications:', err);
-      setNotifications([]);
-    } finally {
-      setLoading(false);
-    }
-  };
+  const {
+    notifications, loading, lastUpdated, reconnect, removeNotification, clearNotifications
+  } = useNotifications();
 
   const deleteNotification = async (notificationId) => {
     try {
@@ -40,7 +20,7 @@ export default function AdminNotifications() {
       });
       
       // Remove from local state immediately
-      setNotifications(prev => prev.filter(n => n.id !== notificationId));
+      removeNotification(notificationId);
     } catch (err) {
       console.error('Échec de suppression de la notification:', err);
     }
@@ -52,20 +32,12 @@ export default function AdminNotifications() {
         withCredentials: true
       });
       
-      setNotifications([]);
+      clearNotifications();
     } catch (err) {
       console.error('Échec de suppression de toutes les notifications:', err);
     }
   };
 
-  useEffect(() => {
-    if (isAdmin) {
-      fetchNotifications();
-      const interval = setInterval(fetchNotifications, 60000); // 1 minute
-      return () => clearInterval(interval);
-    }
-  }, [isAdmin]);
-
   if (!isAdmin) {
     return (
       <div className="bg-white rounded-lg border border-gray-200 p-6 text-center">
@@ -120,7 +92,7 @@ export default function AdminNotifications() {
             </button>
           )}
           <button
-            onClick={fetchNotifications}
+            onClick={reconnect}
             className="p-2 text-gray-500 hover:text-indigo-600 hover:bg-indigo-50 rounded-lg transition-colors"
           >
             <RefreshCw className="h-5 w-5" />
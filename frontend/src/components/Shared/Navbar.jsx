@@ -1,21 +1,21 @@
 // src/components/Shared/Navbar.jsx
-import React, { useState, useEffect } from 'react';
+import React, { useState } from 'react';
 import { Bell, User, X, CheckCircle, AlertTriangle, Clock, PlusCircle, Trash2 } from 'react-feather';
 import { useAuth } from '../../context/AuthContext';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
+import { useNotifications } from '../../context/NotificationContext';
 
 export default function Navbar() {
   const { user, logout } = useAuth();
   const navigate = useNavigate();
-  const [notificationCount, setNotificationCount] = useState(0);
   const [showNotifications, setShowNotifications] = useState(false);
-  const [notifications, setNotifications] = useState([]);
-  const [loading, setLoading] = useState(false);
   const [showUserMenu, setShowUserMenu] = useState(false);
 
   // Only show notifications for admin users
   const isAdmin = user?.role === 'admin';
+  const { notifications, loading, reconnect, removeNotification, clearNotifications } = useNotifications();
+  const notificationCount = notifications.length;
 
   const handleLogout = async () => {
     const success = await logout();
@@ -24,62 +24,16 @@ export default function Navbar() {
     }
   };
 
-  const fetchNotifications = async () => {
-  if (!isAdmin) return;
-  
-  try {
-    setLoading(true);
-    const response = await axios.get('http://localhost:5454/api/notifications', { 
-      withCredentials: true 
-    });
-    
-    if (response.data.success) {
-      // Filter out locally resolved expiry notifications
-      const resolvedExpiryNotifications = JSON.parse(localStorage.getItem('resolvedExpiryNotifications') || '[]');
-      const filteredNotifications = response.data.notifications.filter(notification => 
-        !resolvedExpiryNotifications.includes(notification.id)
-      );
-      
-      setNotifications(filteredNotifications || []);
-      setNotificationCount(filteredNotifications?.length || 0);
-    }
-  } catch (err) {
-    console.error('Failed to fetch notifications:', err);
-    if (err.response?.status === 403) {
-      setNotifications([]);
-      setNotificationCount(0);
-    }
-  } finally {
-    setLoading(false);
-  }
-};
-
   const deleteNotification = async (notificationId) => {
   try {
     await axios.delete(`http://localhost:5454/api/notifications/${notificationId}`, {
       withCredentials: true
     });
-    
-    // For expiry notifications, also mark them as resolved locally
-    if (notificationId.startsWith('exp_')) {
-      // Add to local storage to prevent re-display
-      const resolvedExpiryNotifications = JSON.parse(localStorage.getItem('resolvedExpiryNotifications') || '[]');
-      if (!resolvedExpiryNotifications.includes(notificationId)) {
-        resolvedExpiryNotifications.push(notificationId);
-        localStorage.setItem('resolvedExpiryNotifications', JSON.stringify(resolvedExpiryNotifications));
-      }
-    }
-    
-    // Update local state immediately
-    setNotifications(prev => prev.filter(n => n.id !== notificationId));
-    setNotificationCount(prev => prev - 1);
-    
   } catch (err) {
     console.error('Failed to delete notification:', err);
-    // Even if API call fails, remove from UI
-    setNotifications(prev => prev.filter(n => n.id !== notificationId));
-    setNotificationCount(prev => prev - 1);
   }
+  // Remove from the UI right away; the stream confirms it shortly after
+  removeNotification(notificationId);
 };
 
   const clearAllNotifications = async () => {
@@ -87,14 +41,10 @@ export default function Navbar() {
       await axios.delete('http://localhost:5454/api/notifications/clear-all', {
         withCredentials: true
       });
-      
-      setNotifications([]);
-      setNotificationCount(0);
     } catch (err) {
       console.error('Failed to clear all notifications:', err);
-      setNotifications([]);
-      setNotificationCount(0);
     }
+    clearNotifications();
   };
 
   // Get notification icon based on type
@@ -161,14 +111,6 @@ export default function Navbar() {
     );
   };
 
-  useEffect(() => {
-    if (user && isAdmin) {
-      fetchNotifications();
-      const interval = setInterval(fetchNotifications, 2 * 60 * 1000); // Check every 2 minutes
-      return () => clearInterval(interval);
-    }
-  }, [user, isAdmin]);
-
   return (
     <header className="bg-gradient-to-r from-indigo-800 to-indigo-900 shadow-lg relative z-50">
       {/* Animated background effect */}
@@ -213,7 +155,7 @@ export default function Navbar() {
                     </h3>
                     <div className="flex items-center space-x-2">
                       <button 
-                        onClick={fetchNotifications}
+                        onClick={reconnect}
                         className={`text-xs hover:text-indigo-200 transition-colors px-2 py-1 rounded-lg ${
                           loading ? 'animate-spin' : 'hover:bg-white/20'
                         }`}
@@ -2,19 +2,22 @@ import React from 'react';
 import { Outlet } from 'react-router-dom';
 import AdminSidebar from '../Admin/AdminSidebar';
 import Navbar from '../Shared/Navbar';
+import { NotificationProvider } from '../../context/NotificationContext';
 
 export default function AdminLayout() {
   return (
-    <div className="flex h-screen bg-gray-100">
-      <AdminSidebar />
-      
-      <div className="flex-1 flex flex-col overflow-hidden ml-64">
-        <Navbar />
+    <NotificationProvider>
+      <div className="flex h-screen bg-gray-100">
+        <AdminSidebar />
         
-        <main className="flex-1 overflow-y-auto p-6 bg-gray-50">
-          <Outlet />
-        </main>
+        <div className="flex-1 flex flex-col overflow-hidden ml-64">
+          <Navbar />
+          
+          <main className="flex-1 overflow-y-auto p-6 bg-gray-50">
+            <Outlet />
+          </main>
+        </div>
       </div>
-    </div>
+    </NotificationProvider>
   );
 }
\ No newline at end of file
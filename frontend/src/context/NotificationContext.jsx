@@ -0,0 +1,31 @@
+// src/context/NotificationContext.jsx
+import React, { createContext, useContext } from 'react';
+import { useAuth } from './AuthContext';
+import { useNotificationStream } from '../hooks/useNotificationStream';
+
+const noop = () => {};
+
+// Outside a NotificationProvider (e.g. the service layout's Navbar) there is no stream
+const NotificationContext = createContext({
+  notifications: [],
+  loading: false,
+  lastUpdated: null,
+  reconnect: noop,
+  removeNotification: noop,
+  clearNotifications: noop
+});
+
+export const useNotifications = () => useContext(NotificationContext);
+
+// A single EventSource per tab, shared by the Navbar and the notifications page:
+// browsers allow only six HTTP/1.1 connections per origin
+export const NotificationProvider = ({ children }) => {
+  const { user } = useAuth();
+  const stream = useNotificationStream(user?.role === 'admin');
+
+  return (
+    <NotificationContext.Provider value={stream}>
+      {children}
+    </NotificationContext.Provider>
+  );
+};
@@ -0,0 +1,74 @@
+// src/hooks/useNotificationStream.js
+import { useState, useEffect, useCallback } from 'react';
+
+const STREAM_URL = 'http://localhost:5454/api/notifications/stream';
+
+const severityOrder = { critique: 3, attention: 2, info: 1 };
+
+// Same order as the server: critique first, then by id
+const sortNotifications = (notifications) => [...notifications].sort((a, b) =>
+  (severityOrder[b.severity] || 0) - (severityOrder[a.severity] || 0) || a.id.localeCompare(b.id)
+);
+
+// Admin notifications pushed by the server: a snapshot on connect, then changes.
+// EventSource reconnects by itself and resumes from the last event it received.
+// Components read it through NotificationProvider, so a tab holds a single stream.
+export const useNotificationStream = (enabled) => {
+  const [notifications, setNotifications] = useState([]);
+  const [loading, setLoading] = useState(true);
+  const [lastUpdated, setLastUpdated] = useState(null);
+  const [connection, setConnection] = useState(0);
+
+  useEffect(() => {
+    if (!enabled) {
+      setNotifications([]);
+      return undefined;
+    }
+
+    setLoading(true);
+    const source = new EventSource(STREAM_URL, { withCredentials: true });
+
+    const upsert = (event) => {
+      const notification = JSON.parse(event.data);
+      setNotifications(prev => sortNotifications([
+        ...prev.filter(n => n.id !== notification.id),
+        notification
+      ]));
+      setLastUpdated(new Date().toISOString());
+    };
+
+    source.addEventListener('snapshot', (event) => {
+      const data = JSON.parse(event.data);
+      setNotifications(data.notifications || []);
+      setLastUpdated(data.last_updated);
+      setLoading(false);
+    });
+    source.addEventListener('new', upsert);
+    source.addEventListener('escalated', upsert);
+    source.addEventListener('updated', upsert);
+    source.addEventListener('resolved', (event) => {
+      const { id } = JSON.parse(event.data);
+      setNotifications(prev => prev.filter(n => n.id !== id));
+      setLastUpdated(new Date().toISOString());
+    });
+    source.onerror = () => {
+      // A refused stream (e.g. 403) is closed for good, a dropped one is retried
+      if (source.readyState === EventSource.CLOSED) {
+        setLoading(false);
+      }
+    };
+
+    return () => source.close();
+  }, [enabled, connection]);
+
+  // Open a new stream, which starts with a fresh snapshot
+  const reconnect = useCallback(() => setConnection(c => c + 1), []);
+
+  const removeNotification = useCallback((notificationId) => {
+    setNotifications(prev => prev.filter(n => n.id !== notificationId));
+  }, []);
+
+  const clearNotifications = useCallback(() => setNotifications([]), []);
+
+  return { notifications, loading, lastUpdated, reconnect, removeNotification, clearNotifications };
+};